@@ -0,0 +1,655 @@
+# (ↄ) 2017-2024 eli fessler (frozenpandaman), clovervidia
+# https://github.com/frozenpandaman/s3s
+# License: GPLv3
+
+import base64, datetime, gzip, hashlib, json, mmap, os, struct, sys, tempfile, threading, zlib
+from concurrent.futures import ThreadPoolExecutor
+import utils
+
+# export_format config key - one file per result (optionally compressed), or an append-only NDJSON archive per folder
+EXPORT_FORMATS  = ("json", "json.gz", "json.zst", "ndjson", "ndjson.gz")
+RESULT_SUFFIXES = (".json", ".json.gz", ".json.zst", ".ndjson", ".ndjson.gz")
+
+OVERVIEW_MANIFEST = "s3s_overview_manifest" # marks an overview file as a manifest - see write_overview()
+CHUNK_REF         = "$chunk"
+
+# packed segment archive (--compact flag) - see SegmentArchive
+SEGMENT_INDEX  = "segments.idx"
+SEGMENT_MAX    = 64 * 1024 * 1024 # bytes per segment file before starting a new one
+INDEX_MAGIC    = b"S3SIDX01"
+INDEX_RECORD   = struct.Struct("<31sxIBBHQI") # compact ID, played time, type, mode, segment #, offset, length
+RESULT_TYPES   = ("vsHistoryDetail", "coopHistoryDetail")
+RESULT_MODES   = ("REGULAR", "BANKARA", "X_MATCH", "LEAGUE", "PRIVATE", "FEST", "BIG_RUN", "TEAM_CONTEST") # 255 = other
+
+
+def zstd_available():
+	'''Checks whether the optional zstandard module is installed.'''
+
+	try:
+		import zstandard
+		return True
+	except ModuleNotFoundError:
+		return False
+
+
+def compress(data, filename):
+	'''Compresses bytes according to a filename's extension (.gz, .zst or neither).'''
+
+	if filename.endswith(".gz"):
+		return gzip.compress(data)
+	elif filename.endswith(".zst"):
+		import zstandard
+		return zstandard.ZstdCompressor().compress(data)
+	return data
+
+
+def decompress(data, filename):
+	'''Reverses compress().'''
+
+	if filename.endswith(".gz"):
+		return gzip.decompress(data)
+	elif filename.endswith(".zst"):
+		try:
+			import zstandard
+		except ModuleNotFoundError:
+			print(f"Reading {filename} requires the zstandard module. " \
+				"Please run " + '`\033[91m' + "pip install zstandard" + '\033[0m`' + " and try again.")
+			sys.exit(1)
+		return zstandard.ZstdDecompressor().stream_reader(data).read()
+	return data
+
+
+def is_result_file(filename):
+	'''Whether a file in an export folder holds results (as opposed to e.g. a half-written .tmp file).'''
+
+	return filename.endswith(RESULT_SUFFIXES)
+
+
+def read_results(path):
+	'''Yields every result in an exported file, whatever its format.'''
+
+	filename = os.path.basename(path)
+	if ".ndjson" not in filename:
+		with open(path, "rb") as fin:
+			yield json.loads(decompress(fin.read(), filename))
+		return
+
+	# an interrupted export can leave a partial last line (or gzip member) - keep everything before it
+	with (gzip.open(path, "rb") if filename.endswith(".gz") else open(path, "rb")) as fin:
+		try:
+			for line in fin:
+				try:
+					yield json.loads(line)
+				except ValueError:
+					print(f"(!) Skipping a damaged line in {filename}.")
+		except (EOFError, OSError):
+			print(f"(!) {filename} ends early - was an export interrupted? Using the results before that point.")
+
+
+def _complete_lines(data, filename, skip=0):
+	results = []
+	for line in data[:data.rfind(b"\n") + 1].splitlines()[skip:]:
+		try:
+			results.append(json.loads(line))
+		except ValueError:
+			print(f"(!) Skipping a damaged line in {filename}.")
+	return results
+
+
+def read_ndjson_from(path, offset=0):
+	'''Returns the results on the complete lines of a plain .ndjson file past `offset`, and the offset to resume from.'''
+
+	# -o may be partway through appending a line - that one's picked up next time
+	with open(path, "rb") as fin:
+		fin.seek(offset)
+		data = fin.read()
+	return _complete_lines(data, os.path.basename(path)), offset + data.rfind(b"\n") + 1
+
+
+def read_ndjson_gz_from(path, offset=0, skip_lines=0):
+	'''Like read_ndjson_from(), for .ndjson.gz: returns new results plus the member offset & line count to resume from.'''
+
+	# each -o run appends its own gzip member, so a finished one never needs decompressing again - only the one that's
+	# still being written (flushed after every line) is read again, skipping the lines that were already returned
+	with open(path, "rb") as fin:
+		fin.seek(offset)
+		data = fin.read()
+	results = []
+	while data:
+		member = zlib.decompressobj(wbits=31) # gzip header & trailer
+		try:
+			text = member.decompress(data)
+		except zlib.error as e:
+			raise ValueError(f"damaged gzip data in {os.path.basename(path)}: {e}")
+		results.extend(_complete_lines(text, os.path.basename(path), skip_lines))
+		if not member.eof: # still being written
+			return results, offset, text.count(b"\n")
+		offset += len(data) - len(member.unused_data)
+		data, skip_lines = member.unused_data, 0
+	return results, offset, 0
+
+
+def read_json(path):
+	'''Loads a single (possibly compressed) JSON file, e.g. an overview.'''
+
+	with open(path, "rb") as fin:
+		return json.loads(decompress(fin.read(), os.path.basename(path)))
+
+
+class ExportWriter:
+	'''Writes exported results to a folder on a small worker pool, so writing overlaps with fetching the rest.'''
+
+	# files are written under a temp name and renamed into place, so -i never sees a truncated one
+	def __init__(self, folder, fmt="json", workers=2):
+		self.folder  = folder
+		self.fmt     = fmt
+		self.pool    = ThreadPoolExecutor(max_workers=workers)
+		self.futures = []
+		self.lock    = threading.Lock()
+		self.archive = None
+		os.makedirs(folder, exist_ok=True)
+		if fmt.startswith("ndjson"):
+			self.archive_name = f"archive.{fmt}"
+			archive_path = os.path.join(folder, self.archive_name)
+			self.archive = gzip.open(archive_path, "ab") if fmt.endswith(".gz") else open(archive_path, "ab")
+
+	def write(self, stem, result):
+		'''Queues one result for writing and returns the name of the file it goes in.'''
+		if self.archive is not None:
+			self.futures.append(self.pool.submit(self._append, result))
+			return self.archive_name
+		filename = f"{stem}.{self.fmt}"
+		self.futures.append(self.pool.submit(self._write_file, filename, result))
+		return filename
+
+	def _write_file(self, filename, result):
+		path = os.path.join(self.folder, filename)
+		if os.path.exists(path):
+			return
+		tmp_path = f"{path}.tmp"
+		with open(tmp_path, "wb") as fout:
+			fout.write(compress(json.dumps(result).encode('utf-8'), filename))
+			fout.flush()
+			os.fsync(fout.fileno())
+		os.replace(tmp_path, path)
+
+	def _append(self, result):
+		line = json.dumps(result).encode('utf-8') + b"\n" # encoded in parallel, written one at a time
+		with self.lock:
+			self.archive.write(line)
+			self.archive.flush()
+
+	def close(self):
+		'''Waits for every queued write to finish, raising the first error if there was one.'''
+		try:
+			for future in self.futures:
+				future.result()
+		finally:
+			self.pool.shutdown()
+			if self.archive is not None:
+				self.archive.close()
+
+
+class ResultBuffer:
+	'''List-like store of fetched results that keeps at most `max_bytes` of them in memory, spilling the rest to disk.'''
+
+	# results are only ever kept as raw response bytes (so the ceiling is what's actually held), in memory or past the
+	# ceiling in a shared temp file, and parsed again whenever they're read. buffers made with child() share the same
+	# memory budget & temp file, so one ceiling covers a whole export
+	def __init__(self, max_bytes, _shared=None):
+		self.shared  = _shared or {"max_bytes": max_bytes, "in_memory": 0, "file": None, "lock": threading.Lock()}
+		self.entries = [] # raw bytes, or (offset, length) in the temp file
+		self.in_memory = 0
+
+	def child(self):
+		'''Returns an empty buffer sharing this one's memory budget & temp file.'''
+		return ResultBuffer(self.shared["max_bytes"], self.shared)
+
+	def append(self, result, raw=None):
+		'''Adds a result - `raw` is the response it was parsed from, if there is one.'''
+		data = raw if raw is not None else json.dumps(result).encode('utf-8')
+		shared = self.shared
+		with shared["lock"]:
+			if shared["in_memory"] + len(data) <= shared["max_bytes"]:
+				shared["in_memory"] += len(data)
+				self.in_memory += len(data)
+				self.entries.append(data)
+				return
+			if shared["file"] is None:
+				shared["file"] = tempfile.TemporaryFile(prefix="s3s-")
+			spill = shared["file"]
+			spill.seek(0, os.SEEK_END)
+			self.entries.append((spill.tell(), len(data)))
+			spill.write(data)
+
+	def extend(self, results):
+		for result in results:
+			self.append(result)
+
+	def _load(self, entry):
+		if not isinstance(entry, tuple):
+			return json.loads(entry)
+		offset, length = entry
+		with self.shared["lock"]:
+			self.shared["file"].seek(offset)
+			data = self.shared["file"].read(length)
+		return json.loads(data)
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __getitem__(self, i):
+		return self._load(self.entries[i])
+
+	def __iter__(self):
+		for entry in self.entries:
+			yield self._load(entry)
+
+	def __reversed__(self):
+		for entry in reversed(self.entries):
+			yield self._load(entry)
+
+	@property
+	def spilled(self):
+		return sum(1 for entry in self.entries if isinstance(entry, tuple))
+
+	def release(self):
+		'''Empties this buffer, handing its share of the memory budget back.'''
+		with self.shared["lock"]:
+			self.shared["in_memory"] -= self.in_memory
+		self.entries, self.in_memory = [], 0
+
+	def close(self):
+		'''Empties this buffer & deletes the temp file - for the buffer all the others came from, once done with all of them.'''
+		self.release()
+		if self.shared["file"] is not None:
+			self.shared["file"].close()
+			self.shared["file"] = None
+
+
+class ChunkStore:
+	'''Content-addressed store of JSON chunks - anything identical is only ever saved once.'''
+
+	def __init__(self, path):
+		self.path  = path
+		self.added = 0 # chunks that weren't already stored
+
+	def _file(self, digest):
+		return os.path.join(self.path, digest[:2], f"{digest}.json.gz")
+
+	def put(self, obj):
+		'''Stores an object (if it's not stored already) and returns its digest.'''
+		data = json.dumps(obj, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+		digest = hashlib.sha256(data).hexdigest()
+		path = self._file(digest)
+		if not os.path.exists(path):
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			tmp_path = f"{path}.tmp"
+			with open(tmp_path, "wb") as fout:
+				fout.write(gzip.compress(data))
+			os.replace(tmp_path, path)
+			self.added += 1
+		return digest
+
+	def get(self, digest):
+		with open(self._file(digest), "rb") as fin:
+			return json.loads(gzip.decompress(fin.read()))
+
+
+def _split_history_groups(obj, store):
+	'''Replaces every history group in query1 screens with a reference to its chunk.'''
+
+	# each group is one play session - only the newest (and the oldest, as results age out) change between exports
+	if isinstance(obj, dict):
+		split = {}
+		for key, value in obj.items():
+			if key == "historyGroups" and isinstance(value, dict) and isinstance(value.get("nodes"), list):
+				split[key] = dict(value, nodes=[{CHUNK_REF: store.put(group)} for group in value["nodes"]])
+			else:
+				split[key] = _split_history_groups(value, store)
+		return split
+	elif isinstance(obj, list):
+		return [_split_history_groups(item, store) for item in obj]
+	return obj
+
+
+def _join_history_groups(obj, store):
+	'''Reverses _split_history_groups().'''
+
+	if isinstance(obj, dict):
+		if len(obj) == 1 and CHUNK_REF in obj:
+			return store.get(obj[CHUNK_REF])
+		return {key: _join_history_groups(value, store) for key, value in obj.items()}
+	elif isinstance(obj, list):
+		return [_join_history_groups(item, store) for item in obj]
+	return obj
+
+
+def write_overview(path, screens, chunks_dir):
+	'''Saves overview (query1) screens as a manifest, with their history groups in a shared chunk store. Returns # of new chunks.'''
+
+	store = ChunkStore(chunks_dir)
+	manifest = {
+		OVERVIEW_MANIFEST: 1,
+		"chunks":  os.path.relpath(chunks_dir, os.path.dirname(os.path.abspath(path))),
+		"screens": [_split_history_groups(screen, store) for screen in screens] # may be a ResultBuffer - read one at a time
+	}
+	utils.write_json_atomic(path, manifest)
+	return store.added
+
+
+def read_overview(path):
+	'''Loads an overview file - plain or a manifest from write_overview() - as the original list of screens.'''
+
+	overview = read_json(path)
+	if isinstance(overview, dict) and OVERVIEW_MANIFEST in overview:
+		chunks_dir = os.path.join(os.path.dirname(os.path.abspath(path)), overview["chunks"])
+		return _join_history_groups(overview["screens"], ChunkStore(chunks_dir))
+	return overview
+
+
+def segment_key(b64_id):
+	'''Returns the fixed-size (31-byte) index key for a result ID - its compact ID, or a hash of unusual ones.'''
+
+	key = utils.compact_id(b64_id)
+	return key if len(key) == 31 else hashlib.sha256(key).digest()[:31]
+
+
+class SegmentArchive:
+	'''Results packed into append-only segment files, with a sorted index that's memory-mapped for random access.'''
+
+	# segments are plain NDJSON (so still readable without the index); the index holds fixed-size records sorted by
+	# compact ID, which starts with the played time - so it's in chronological order, too
+	def __init__(self, folder):
+		self.folder   = folder
+		self.segments = {} # segment # -> (file, mmap)
+		self.index    = None
+		self.count    = 0
+		self._index_file = None
+		self._open_index()
+
+	def _open_index(self):
+		path = os.path.join(self.folder, SEGMENT_INDEX)
+		if not os.path.exists(path) or os.path.getsize(path) <= len(INDEX_MAGIC):
+			return
+		self._index_file = open(path, "rb")
+		self.index = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+		if self.index[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+			raise ValueError(f"{path} is not an s3s segment index")
+		self.count = (len(self.index) - len(INDEX_MAGIC)) // INDEX_RECORD.size
+
+	def __len__(self):
+		return self.count
+
+	def record(self, i):
+		'''Returns index record #i as (key, played time, type, mode, segment #, offset, length).'''
+		return INDEX_RECORD.unpack_from(self.index, len(INDEX_MAGIC) + i*INDEX_RECORD.size)
+
+	def keys(self):
+		for i in range(self.count):
+			yield self.record(i)[0]
+
+	def _read(self, segment, offset, length):
+		if segment not in self.segments:
+			seg_file = open(os.path.join(self.folder, f"segment-{segment:05d}.seg"), "rb")
+			self.segments[segment] = (seg_file, mmap.mmap(seg_file.fileno(), 0, access=mmap.ACCESS_READ))
+		return json.loads(self.segments[segment][1][offset:offset+length])
+
+	def find(self, b64_id):
+		'''Returns the result with the given ID (binary search - no scanning), or None.'''
+		key = segment_key(b64_id)
+		lo, hi = 0, self.count
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self.record(mid)[0] < key:
+				lo = mid + 1
+			else:
+				hi = mid
+		if lo < self.count and self.record(lo)[0] == key:
+			return self._read(*self.record(lo)[4:])
+		return None
+
+	def results(self, skip_keys=()):
+		'''Yields every result, oldest first - except ones whose index key is in `skip_keys`.'''
+		for i in range(self.count):
+			record = self.record(i)
+			if record[0] not in skip_keys:
+				yield self._read(*record[4:])
+
+	def __iter__(self):
+		return self.results()
+
+	def add_results(self, results):
+		'''Appends results that aren't in the archive yet & rewrites the index. Returns how many were added.'''
+		entries = [self.record(i) for i in range(self.count)]
+		known = set(entry[0] for entry in entries)
+		segment = max((entry[4] for entry in entries), default=1)
+		self.close()
+
+		os.makedirs(self.folder, exist_ok=True)
+		fout = open(os.path.join(self.folder, f"segment-{segment:05d}.seg"), "ab")
+		added = 0
+		try:
+			for result in results:
+				result_type = next((i for i, detail_key in enumerate(RESULT_TYPES) if result["data"].get(detail_key)), None)
+				if result_type is None:
+					continue
+				detail = result["data"][RESULT_TYPES[result_type]]
+				key = segment_key(detail["id"])
+				if key in known:
+					continue
+				data = json.dumps(result).encode('utf-8')
+				if fout.tell() > 0 and fout.tell() + len(data) > SEGMENT_MAX:
+					fout.close()
+					segment += 1
+					fout = open(os.path.join(self.folder, f"segment-{segment:05d}.seg"), "ab")
+				offset = fout.tell()
+				fout.write(data + b"\n")
+
+				mode = (detail.get("vsMode") or {}).get("mode") if result_type == 0 else detail.get("rule")
+				mode = RESULT_MODES.index(mode) if mode in RESULT_MODES else 255
+				entries.append((key, utils.epoch_time(detail["playedTime"]), result_type, mode, segment, offset, len(data)))
+				known.add(key)
+				added += 1
+			fout.flush()
+			os.fsync(fout.fileno())
+		finally:
+			fout.close()
+
+		# the new index only replaces the old one once everything it points to is on disk
+		entries.sort()
+		index_path = os.path.join(self.folder, SEGMENT_INDEX)
+		with open(f"{index_path}.tmp", "wb") as index_out:
+			index_out.write(INDEX_MAGIC)
+			for entry in entries:
+				index_out.write(INDEX_RECORD.pack(*entry))
+			index_out.flush()
+			os.fsync(index_out.fileno())
+		os.replace(f"{index_path}.tmp", index_path)
+		self._open_index()
+		return added
+
+	def close(self):
+		for seg_file, seg_map in self.segments.values():
+			seg_map.close()
+			seg_file.close()
+		self.segments = {}
+		if self.index is not None:
+			self.index.close()
+			self._index_file.close()
+		self.index, self.count = None, 0
+
+
+def compact_export_dir(folder):
+	'''Packs the loose result files in an export folder into its segment archive, deleting them once they're safely packed.
+	Returns (# of files packed, # of results added).'''
+
+	loose = sorted(name for name in os.listdir(folder) if is_result_file(name))
+	file_keys, damaged = {}, []
+
+	def loose_results():
+		for filename in loose:
+			try:
+				results = list(read_results(os.path.join(folder, filename)))
+			except (IOError, ValueError, EOFError):
+				damaged.append(filename)
+				continue
+			file_keys[filename] = [segment_key(result["data"][detail_key]["id"])
+				for result in results for detail_key in RESULT_TYPES if result["data"].get(detail_key)]
+			yield from results
+
+	segments = SegmentArchive(folder)
+	try:
+		added = segments.add_results(loose_results())
+		packed = set(segments.keys())
+	finally:
+		segments.close()
+
+	removed = 0
+	for filename, keys in file_keys.items():
+		if all(key in packed for key in keys):
+			os.remove(os.path.join(folder, filename))
+			removed += 1
+	for filename in damaged:
+		print(f"(!) Could not read {filename} - left as is.")
+	return removed, added
+
+
+def result_detail(result):
+	'''Returns a result's vsHistoryDetail or coopHistoryDetail, or None.'''
+
+	data = result.get("data") or {}
+	return data.get("vsHistoryDetail") or data.get("coopHistoryDetail")
+
+
+def _stem_time(filename):
+	'''Returns the played time encoded in an exported file's name (see export_results()), or None if it's not one.'''
+
+	try:
+		played = datetime.datetime.strptime(filename.split(".")[0], "%Y%m%dT%H%M%SZ")
+	except ValueError:
+		return None
+	return int((played - datetime.datetime(1970, 1, 1)).total_seconds())
+
+
+def stream_results(folder):
+	'''Yields every result in an export folder, oldest first & without duplicates, parsing them one at a time.'''
+
+	# first a plan - where each result is & when it was played - so only a small tuple per result is ever held
+	# loose files are ordered by name; ndjson archives are scanned once (compressed ones spooled to a temp file so they
+	# can be seeked); packed segments already have their played times in the index
+	plan, sources = [], [] # plan: (played time, source #, offset, length) - length None for a whole file
+	for filename in sorted(os.listdir(folder)):
+		path = os.path.join(folder, filename)
+		if not is_result_file(filename):
+			continue
+		if ".ndjson" not in filename:
+			played = _stem_time(filename)
+			if played is None: # added or renamed by hand - look inside
+				try:
+					played = utils.epoch_time(result_detail(next(read_results(path)))["playedTime"])
+				except (IOError, ValueError, EOFError, KeyError, TypeError, StopIteration):
+					print(f"(!) Could not read {filename} - skipping.")
+					continue
+			sources.append(path)
+			plan.append((played, len(sources) - 1, 0, None))
+			continue
+
+		spool = tempfile.TemporaryFile() if filename.endswith(".gz") else None
+		sources.append(spool or path)
+		offset = 0
+		with (gzip.open(path, "rb") if spool else open(path, "rb")) as fin:
+			try:
+				for line in fin:
+					try:
+						played = utils.epoch_time(result_detail(json.loads(line))["playedTime"])
+					except (ValueError, KeyError, TypeError):
+						print(f"(!) Skipping a damaged line in {filename}.")
+						played = None
+					if spool:
+						spool.write(line)
+					if played is not None:
+						plan.append((played, len(sources) - 1, offset, len(line)))
+					offset += len(line)
+			except (EOFError, OSError):
+				print(f"(!) {filename} ends early - was an export interrupted? Using the results before that point.")
+
+	if os.path.exists(os.path.join(folder, SEGMENT_INDEX)): # packed with --compact
+		segments, segment_sources = SegmentArchive(folder), {}
+		for i in range(len(segments)):
+			key, played, result_type, mode, segment, offset, length = segments.record(i)
+			if segment not in segment_sources:
+				sources.append(os.path.join(folder, f"segment-{segment:05d}.seg"))
+				segment_sources[segment] = len(sources) - 1
+			plan.append((played, segment_sources[segment], offset, length))
+		segments.close()
+	plan.sort()
+
+	seen, handles = set(), {}
+	try:
+		for played, source, offset, length in plan:
+			if length is None:
+				result = next(read_results(sources[source]))
+			else:
+				if source not in handles:
+					handles[source] = sources[source] if not isinstance(sources[source], str) else open(sources[source], "rb")
+				handles[source].seek(offset)
+				result = json.loads(handles[source].read(length))
+			detail = result_detail(result)
+			if detail is None: # e.g. {"vsHistoryDetail": null}
+				continue
+			key = segment_key(detail["id"])
+			if key not in seen: # the same result can be both packed & loose, or exported twice
+				seen.add(key)
+				yield result
+	finally:
+		for source in sources + list(handles.values()):
+			if not isinstance(source, str):
+				source.close()
+
+
+def index_export_dir(results_dir, detail_key):
+	'''Returns {compact ID: filename} for results already exported to a folder, using & refreshing its saved index.'''
+
+	# kept next to the folder (results.index.json), since -i reads every result file inside it
+	index_path = f"{os.path.normpath(results_dir)}.index.json"
+	try:
+		with open(index_path) as index_file:
+			saved = json.load(index_file)
+	except (IOError, ValueError):
+		saved = {}
+	try:
+		filenames = set(name for name in os.listdir(results_dir) if is_result_file(name))
+	except OSError:
+		return {}
+
+	# .ndjson archives are read every time - an interrupted export can append lines that never made it into the index
+	index = {base64.b64decode(key): filename for key, filename in saved.items()
+		if filename in filenames and ".ndjson" not in filename}
+	indexed = set(index.values())
+	for filename in filenames - indexed: # exported before there was an index, or added by hand
+		try:
+			for result in read_results(os.path.join(results_dir, filename)):
+				index[utils.compact_id(result["data"][detail_key]["id"])] = filename
+		except (IOError, ValueError, KeyError, TypeError):
+			continue
+
+	save_export_index(results_dir, index)
+
+	if os.path.exists(os.path.join(results_dir, SEGMENT_INDEX)): # packed with --compact
+		segments = SegmentArchive(results_dir)
+		index.update(dict.fromkeys(segments.keys(), SEGMENT_INDEX))
+		segments.close()
+	return index
+
+
+def save_export_index(results_dir, index):
+	'''Saves an index from index_export_dir().'''
+
+	utils.write_json_atomic(f"{os.path.normpath(results_dir)}.index.json",
+		{base64.b64encode(key).decode('ascii'): filename for key, filename in index.items()})
+
+
+if __name__ == "__main__":
+	print("This program cannot be run alone. See https://github.com/frozenpandaman/s3s")
+	sys.exit(0)
@@ -0,0 +1,76 @@
+# (ↄ) 2017-2024 eli fessler (frozenpandaman), clovervidia
+# https://github.com/frozenpandaman/s3s
+# License: GPLv3
+
+import json, queue, sys, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMMANDS = ("backfill", "export", "shutdown") # POST /<command>
+
+
+class ControlServer:
+	'''Local HTTP control surface for daemon mode (--daemon flag): Prometheus metrics, status & queued commands.'''
+
+	# only ever binds to localhost - there's no auth, and anyone who can reach it can trigger uploads
+	def __init__(self, port, metrics, get_status, host="127.0.0.1"):
+		self.metrics    = metrics
+		self.get_status = get_status # returns a JSON-safe dict describing the monitoring state
+		self.commands   = queue.Queue() # run by the monitoring loop, on the main thread
+		self.httpd      = ThreadingHTTPServer((host, port), self._handler())
+		self.httpd.daemon_threads = True
+		self.thread     = threading.Thread(target=self.httpd.serve_forever, name="s3s-control", daemon=True)
+
+	def start(self):
+		self.thread.start()
+
+	def stop(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+	def next_command(self, timeout):
+		'''Waits up to `timeout` secs for a queued command, returning its name or None.'''
+		try:
+			return self.commands.get(timeout=max(0, timeout))
+		except queue.Empty:
+			return None
+
+	def _handler(self):
+		server = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def _send(self, status, body, content_type="application/json"):
+				body = body.encode("utf-8")
+				self.send_response(status)
+				self.send_header("Content-Type", content_type)
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def do_GET(self):
+				if self.path == "/metrics":
+					self._send(200, server.metrics.render(), "text/plain; version=0.0.4")
+				elif self.path == "/status":
+					status = dict(server.get_status(), queued_commands=server.commands.qsize())
+					self._send(200, json.dumps(status, indent=4))
+				elif self.path == "/healthz":
+					self._send(200, json.dumps({"ok": True}))
+				else:
+					self._send(404, json.dumps({"error": "not found"}))
+
+			def do_POST(self):
+				command = self.path.strip("/")
+				if command not in COMMANDS:
+					self._send(404, json.dumps({"error": f"unknown command - use one of: {', '.join(COMMANDS)}"}))
+					return
+				server.commands.put(command)
+				self._send(202, json.dumps({"queued": command}))
+
+			def log_message(self, format, *args): # keep the console for s3s' own output
+				pass
+
+		return Handler
+
+
+if __name__ == "__main__":
+	print("This program cannot be run alone. See https://github.com/frozenpandaman/s3s")
+	sys.exit(0)
@@ -0,0 +1,122 @@
+# (ↄ) 2017-2024 eli fessler (frozenpandaman), clovervidia
+# https://github.com/frozenpandaman/s3s
+# License: GPLv3
+
+import os, sys, threading, time
+import msgpack
+
+RETRY_BASE_SECS = 60       # first retry a minute after a failed upload...
+RETRY_MAX_SECS  = 6*60*60  # ...doubling each time, up to every 6 hours
+
+
+class Outbox:
+	'''Persistent queue of converted stat.ink payloads, saved before uploading so nothing is lost if stat.ink is down.'''
+
+	# one file per result & account, named after the payload's uuid - re-adding the same result just replaces it. the
+	# account is part of the name since two monitored accounts in the same match upload the same battle uuid
+	def __init__(self, path):
+		self.path        = path
+		self.failed_path = os.path.join(path, "failed") # rejected by stat.ink - kept for inspection, never retried
+		self.lock        = threading.Lock()
+
+	def _file(self, key, failed=False):
+		return os.path.join(self.failed_path if failed else self.path, f"{key}.msgpack")
+
+	def _write(self, key, item):
+		os.makedirs(self.path, exist_ok=True)
+		tmp_path = f"{self._file(key)}.tmp"
+		with open(tmp_path, "wb") as fout:
+			fout.write(msgpack.packb(item, use_bin_type=True))
+			fout.flush()
+			os.fsync(fout.fileno())
+		os.replace(tmp_path, self._file(key))
+
+	def _read(self, key, failed=False):
+		try:
+			with open(self._file(key, failed), "rb") as fin:
+				return msgpack.unpackb(fin.read(), raw=False)
+		except (OSError, ValueError, msgpack.ExtraData):
+			return None
+
+	@staticmethod
+	def key(which, result_uuid, account=None):
+		'''Returns the key a payload is queued under (account names can't contain "." - see load_accounts()).'''
+		return f"{which}-{result_uuid}" if account is None else f"{account}.{which}-{result_uuid}"
+
+	def put(self, which, result_uuid, packed_payload, account=None):
+		'''Saves a payload before it's uploaded and returns its key. The first retry isn't due for a while.'''
+		key = self.key(which, result_uuid, account)
+		now = time.time()
+		item = {
+			"which":      which, # "ink" or "salmon"
+			"uuid":       result_uuid,
+			"account":    account, # profile name for multi-account monitoring, or None
+			"created":    now,
+			"attempts":   0,
+			"next_try":   int(now) + RETRY_BASE_SECS,
+			"last_error": None,
+			"payload":    packed_payload
+		}
+		with self.lock:
+			self._write(key, item)
+		return key
+
+	def remove(self, key):
+		'''Drops a payload once stat.ink has it.'''
+		with self.lock:
+			try:
+				os.remove(self._file(key))
+			except OSError:
+				pass
+
+	def record_failure(self, key, error, permanent=False):
+		'''Notes a failed upload, scheduling a retry with exponential backoff - or shelving it if retrying won't help.'''
+		with self.lock:
+			item = self._read(key)
+			if item is None:
+				return
+			item["attempts"]  += 1
+			item["last_error"] = str(error)[:500]
+			item["next_try"]   = int(time.time()) + min(RETRY_BASE_SECS * 2**(item["attempts"] - 1), RETRY_MAX_SECS)
+			if permanent:
+				os.makedirs(self.failed_path, exist_ok=True)
+				self._write(key, item)
+				os.replace(self._file(key), self._file(key, failed=True))
+			else:
+				self._write(key, item)
+
+	def pending(self, due_only=False, failed=False):
+		'''Returns [(key, item)] for queued payloads, oldest first - only those due for a retry if `due_only`.'''
+		folder = self.failed_path if failed else self.path
+		with self.lock:
+			try:
+				keys = [name[:-8] for name in os.listdir(folder) if name.endswith(".msgpack")]
+			except OSError:
+				return []
+			items = [(key, self._read(key, failed)) for key in keys]
+		now = time.time()
+		items = [(key, item) for key, item in items if item is not None and (not due_only or item["next_try"] <= now)]
+		return sorted(items, key=lambda entry: entry[1]["created"])
+
+	def release(self, key):
+		'''Makes a payload due right away (flushing), moving it back out of failed/ if needed.'''
+		with self.lock:
+			failed = not os.path.exists(self._file(key)) and os.path.exists(self._file(key, failed=True))
+			item = self._read(key, failed)
+			if item is None:
+				return
+			item["next_try"] = 0
+			self._write(key, item)
+			if failed:
+				os.remove(self._file(key, failed=True))
+
+	def __len__(self):
+		try:
+			return sum(1 for name in os.listdir(self.path) if name.endswith(".msgpack"))
+		except OSError:
+			return 0
+
+
+if __name__ == "__main__":
+	print("This program cannot be run alone. See https://github.com/frozenpandaman/s3s")
+	sys.exit(0)
@@ -0,0 +1,150 @@
+# (ↄ) 2017-2024 eli fessler (frozenpandaman), clovervidia
+# https://github.com/frozenpandaman/s3s
+# License: GPLv3
+
+import json, sqlite3, sys, time, uuid
+import utils
+
+SQLITE_MAGIC = b"SQLite format 3\x00"
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+	id        TEXT PRIMARY KEY, -- SplatNet 3 (base64) ID
+	kind      TEXT NOT NULL,    -- "battle" or "job"
+	uuid      TEXT NOT NULL,    -- as uploaded to stat.ink
+	played    INTEGER NOT NULL, -- playedTime, as epoch time
+	mode      TEXT,             -- vsMode.mode, or the job's rule (REGULAR, BIG_RUN, TEAM_CONTEST)
+	rule      TEXT,             -- vsRule.rule; NULL for jobs
+	stage     TEXT,
+	weapon    TEXT,
+	judgement TEXT,             -- WIN, LOSE, ...; CLEAR or FAILURE for jobs
+	uploaded  INTEGER NOT NULL DEFAULT 0,
+	detail    TEXT NOT NULL     -- the full result JSON
+);
+CREATE INDEX IF NOT EXISTS results_played   ON results (kind, played);
+CREATE INDEX IF NOT EXISTS results_mode     ON results (kind, mode, rule, played);
+CREATE INDEX IF NOT EXISTS results_uploaded ON results (uploaded, played);
+CREATE INDEX IF NOT EXISTS results_uuid     ON results (uuid);
+CREATE TABLE IF NOT EXISTS overviews (
+	fetched   INTEGER NOT NULL,
+	data      TEXT NOT NULL
+);
+'''
+
+
+def is_result_db(path):
+	'''Returns True if the file at `path` is an SQLite database (i.e. a --db result store).'''
+
+	try:
+		with open(path, "rb") as fin:
+			return fin.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+	except OSError:
+		return False
+
+
+def result_uuid(kind, b64_id):
+	'''Returns the uuid stat.ink knows a battle or job by (the same ones post_result() uploads with).'''
+
+	full_id = utils.b64d(b64_id)
+	if kind == "battle":
+		return str(uuid.uuid5(utils.S3S_NAMESPACE, full_id[-52:]))
+	return str(uuid.uuid5(utils.SALMON_NAMESPACE, full_id))
+
+
+class ResultDB:
+	'''Optional SQLite result store (--db flag): full result JSON plus indexed columns, so filters run as SQL.'''
+
+	def __init__(self, path):
+		self.path = path
+		self.conn = sqlite3.connect(path)
+		self.conn.executescript(SCHEMA)
+
+	def add_result(self, result):
+		'''Stores a result from fetch_json(); a result that's already stored is left alone. Returns True if it was new.'''
+		if result["data"].get("vsHistoryDetail"):
+			detail = result["data"]["vsHistoryDetail"]
+			kind = "battle"
+			mode = (detail.get("vsMode") or {}).get("mode") # null for some results
+			rule = (detail.get("vsRule") or {}).get("rule")
+			weapon = ((detail.get("player") or {}).get("weapon") or {}).get("name")
+			judgement = detail.get("judgement")
+			stage = (detail.get("vsStage") or {}).get("name")
+		elif result["data"].get("coopHistoryDetail"):
+			detail = result["data"]["coopHistoryDetail"]
+			kind, mode, rule = "job", detail.get("rule"), None
+			weapons = (detail.get("myResult") or {}).get("weapons") or [{}]
+			weapon = weapons[0].get("name")
+			judgement = "CLEAR" if detail.get("resultWave") == 0 else "FAILURE"
+			stage = (detail.get("coopStage") or {}).get("name")
+		else:
+			return False
+
+		with self.conn:
+			cursor = self.conn.execute('''INSERT OR IGNORE INTO results
+				(id, kind, uuid, played, mode, rule, stage, weapon, judgement, detail) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+				(detail["id"], kind, result_uuid(kind, detail["id"]), utils.epoch_time(detail["playedTime"]),
+				mode, rule, stage, weapon, judgement, json.dumps(result)))
+		return cursor.rowcount == 1
+
+	def ids(self):
+		'''Returns the IDs of every stored result.'''
+		return [row[0] for row in self.conn.execute("SELECT id FROM results")]
+
+	def add_overview(self, screens):
+		'''Stores the overview (history list) screens from an export.'''
+		with self.conn:
+			self.conn.execute("INSERT INTO overviews (fetched, data) VALUES (?, ?)", (int(time.time()), json.dumps(screens)))
+
+	def latest_overview(self):
+		'''Returns the most recently stored overview screens, or None.'''
+		row = self.conn.execute("SELECT data FROM overviews ORDER BY fetched DESC, rowid DESC LIMIT 1").fetchone()
+		return json.loads(row[0]) if row else None
+
+	def mark_uploaded(self, uuids):
+		'''Flags the results with these stat.ink uuids as uploaded.'''
+		with self.conn:
+			self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS statink_uuids (uuid TEXT PRIMARY KEY)")
+			self.conn.execute("DELETE FROM statink_uuids")
+			self.conn.executemany("INSERT OR IGNORE INTO statink_uuids VALUES (?)", ((u,) for u in uuids))
+			self.conn.execute('''UPDATE results SET uploaded = 1
+				WHERE uploaded = 0 AND uuid IN (SELECT uuid FROM statink_uuids)''')
+
+	def _where(self, kind=None, since=None, until=None, mode=None, rule=None, stage=None, pending_only=False):
+		clauses, params = [], []
+		for column, value in (("kind", kind), ("mode", mode), ("rule", rule), ("stage", stage)):
+			if value is not None:
+				clauses.append(f"{column} = ?")
+				params.append(value)
+		if since is not None:
+			clauses.append("played >= ?")
+			params.append(since)
+		if until is not None:
+			clauses.append("played < ?")
+			params.append(until)
+		if pending_only:
+			clauses.append("uploaded = 0")
+		return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+	def count(self, **filters):
+		'''Returns how many stored results match the filters (see query()).'''
+		where, params = self._where(**filters)
+		return self.conn.execute(f"SELECT COUNT(*) FROM results{where}", params).fetchone()[0]
+
+	def query(self, **filters):
+		'''Yields matching results, oldest first. Filters: kind, since/until (epoch time), mode, rule, stage, pending_only.'''
+		where, params = self._where(**filters)
+		for row in self.conn.execute(f"SELECT detail FROM results{where} ORDER BY played, id", params):
+			yield json.loads(row[0])
+
+	def rows_after(self, rowid):
+		'''Yields (rowid, result) for results stored after the given row, in the order they were stored.'''
+		for row in self.conn.execute("SELECT rowid, detail FROM results WHERE rowid > ? ORDER BY rowid", (rowid,)):
+			yield row[0], json.loads(row[1])
+
+	def close(self):
+		self.conn.close()
+
+
+if __name__ == "__main__":
+	print("This program cannot be run alone. See https://github.com/frozenpandaman/s3s")
+	sys.exit(0)
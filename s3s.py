@@ -4,12 +4,17 @@
 # https://github.com/frozenpandaman/s3s
 # License: GPLv3
 
-import argparse, base64, datetime, json, os, shutil, re, sys, time, uuid
+import argparse, atexit, base64, datetime, gzip, json, os, shutil, re, signal, sys, threading, time, tracemalloc, uuid
 from concurrent.futures import ThreadPoolExecutor
 from subprocess import call
 import requests, msgpack
 from packaging import version
-import iksm, utils
+import archive, control, iksm, outbox, resultdb, stats, utils, watch
+
+try:
+	from urllib3.util.request import ACCEPT_ENCODING # includes br/zstd if brotli/zstandard are installed
+except ImportError:
+	ACCEPT_ENCODING = "gzip,deflate"
 
 A_VERSION = "0.7.0"
 
@@ -52,6 +57,64 @@ F_GEN_URL     = CONFIG_DATA["f_gen"]         # endpoint for generating f (imink
 
 thread_pool = ThreadPoolExecutor(max_workers=2)
 
+# MULTI-ACCOUNT MONITORING - profiles under the "accounts" config key, swapped into the globals above one at a time
+ACTIVE_ACCOUNT      = None # name of the profile in use, or None for the top-level account in config.txt
+ACCOUNT_TOKEN_TIMES = {}   # per-account TOKENS_VALIDATED_AT while another account is active
+ACCOUNT_COOKIES     = {}   # per-account cookie jars for SESSION while another account is active
+ACCOUNT_KEYS        = ("api_key", "acc_loc", "gtoken", "bullettoken", "session_token")
+
+# MONITORING STATE - saved after every check so -M can resume after a restart
+CHECKPOINT_PATH     = os.path.join(app_path, "monitor_state.json")
+STOP_SIGNAL         = None # set if monitoring was stopped by a signal (e.g. SIGTERM) rather than Ctrl+C
+SYNC_STATE_PATH     = os.path.join(app_path, "sync_state.json") # high-water marks for --sync
+OUTBOX              = outbox.Outbox(os.path.join(app_path, "outbox")) # payloads not yet accepted by stat.ink
+TOKENS_VALIDATED_AT = 0   # epoch time the current tokens last worked
+TOKEN_RECHECK_SECS  = 600 # skip the homepage check in monitoring mode if tokens were validated this recently
+SALMON_MIN_SECS     = 360 # a job takes far longer than a battle, so jobs are polled less often when monitoring both
+
+# WATCH MODE (-i with --watch)
+WATCH_IDLE_SECS     = 60   # longest wait for a file event before checking again
+WATCH_SETTLE_SECS   = 2    # files written within this long of each other are uploaded as one batch
+WATCH_REFRESH_SECS  = 3600 # re-download stat.ink's uuid lists this often
+RESULT_BUFFER_MB    = 64   # default memory ceiling for results held during -o (result_buffer_mb config key)
+
+# SHARED HTTP SESSION - keeps connections alive & counts bytes transferred
+transfer_lock  = threading.Lock()
+TRANSFER_STATS = {"sent": 0, "sent_saved": 0, "slimmed": 0, "received": 0, "received_decoded": 0}
+UPLOAD_COMPRESSION = utils.custom_key_exists("compress_uploads", CONFIG_DATA) # off unless enabled
+METRICS = utils.Metrics() # exposed at /metrics in daemon mode
+
+
+def count_transfer(resp, *args, **kwargs):
+	'''Response hook that tallies request and response sizes (on the wire vs. decoded) for the transfer report.'''
+
+	decoded = len(resp.content)
+	try:
+		wire = resp.raw.tell() or decoded # compressed bytes actually read
+	except (AttributeError, ValueError):
+		wire = decoded
+	body = resp.request.body or b""
+	with transfer_lock:
+		TRANSFER_STATS["sent"]             += len(body)
+		TRANSFER_STATS["received"]         += wire
+		TRANSFER_STATS["received_decoded"] += decoded
+	METRICS.inc("bytes_sent_total", len(body))
+	METRICS.inc("bytes_received_total", wire)
+
+
+SESSION = requests.Session()
+SESSION.hooks["response"].append(count_transfer)
+
+# SPLATNET REQUEST PRIORITIES - lower goes first whenever requests are waiting on each other
+PRIORITY_RESULT       = 0 # listings & details for new results - what actually gets uploaded
+PRIORITY_LINEAGE      = 1 # overview & previous-job lookups while building a payload
+PRIORITY_BACKFILL     = 2 # -r, -o
+PRIORITY_HOUSEKEEPING = 3 # token validation, seed checker
+PRIORITY_NAMES = {PRIORITY_RESULT: "result", PRIORITY_LINEAGE: "lineage", PRIORITY_BACKFILL: "backfill",
+	PRIORITY_HOUSEKEEPING: "housekeeping"}
+SPLATNET_GATE = utils.PriorityGate(slots=2) # at most 2 requests in flight, like the thread pool
+QUEUE_WAITS   = {} # priority name -> [requests, total secs waited, longest wait]
+
 # SET HTTP HEADERS
 DEFAULT_USER_AGENT = 'Mozilla/5.0 (Linux; Android 14; Pixel 7a) ' \
 						'AppleWebKit/537.36 (KHTML, like Gecko) ' \
@@ -69,21 +132,86 @@ def write_config(tokens):
 
 	config_file = open(config_path, "r")
 	CONFIG_DATA = json.load(config_file)
+	set_account_globals(account_config(CONFIG_DATA))
+	config_file.close()
+
+
+def account_config(config_data=None):
+	'''Returns the part of the config holding the active account's tokens, stat.ink key & language.'''
+
+	config_data = CONFIG_DATA if config_data is None else config_data
+	if ACTIVE_ACCOUNT is None:
+		return config_data
+	return config_data["accounts"][ACTIVE_ACCOUNT]
+
+
+def set_account_globals(account):
+	'''Updates the token & key globals from an account's config.'''
 
 	global API_KEY
-	API_KEY = CONFIG_DATA["api_key"]
+	API_KEY = account["api_key"]
 	global USER_LANG
-	USER_LANG = CONFIG_DATA["acc_loc"][:5]
+	USER_LANG = account["acc_loc"][:5]
 	global USER_COUNTRY
-	USER_COUNTRY = CONFIG_DATA["acc_loc"][-2:]
+	USER_COUNTRY = account["acc_loc"][-2:]
 	global GTOKEN
-	GTOKEN = CONFIG_DATA["gtoken"]
+	GTOKEN = account["gtoken"]
 	global BULLETTOKEN
-	BULLETTOKEN = CONFIG_DATA["bullettoken"]
+	BULLETTOKEN = account["bullettoken"]
 	global SESSION_TOKEN
-	SESSION_TOKEN = CONFIG_DATA["session_token"]
+	SESSION_TOKEN = account["session_token"]
 
-	config_file.close()
+
+def use_account(name):
+	'''Switches to another account profile from config.txt (multi-account monitoring). None = the top-level account.'''
+
+	global ACTIVE_ACCOUNT, TOKENS_VALIDATED_AT, CHECKPOINT_PATH
+	if name == ACTIVE_ACCOUNT:
+		return
+
+	ACCOUNT_TOKEN_TIMES[ACTIVE_ACCOUNT] = TOKENS_VALIDATED_AT
+	ACCOUNT_COOKIES[ACTIVE_ACCOUNT]     = SESSION.cookies # don't let one account's cookies ride along with another's requests
+	ACTIVE_ACCOUNT      = name
+	TOKENS_VALIDATED_AT = ACCOUNT_TOKEN_TIMES.get(name, 0)
+	SESSION.cookies     = ACCOUNT_COOKIES.get(name) or requests.cookies.RequestsCookieJar()
+	CHECKPOINT_PATH     = os.path.join(app_path, "monitor_state.json" if name is None else f"monitor_state-{name}.json")
+	set_account_globals(account_config())
+
+
+def account_label():
+	'''Returns the active account's name, for metrics & status.'''
+
+	return ACTIVE_ACCOUNT or "default"
+
+
+def load_accounts(names):
+	'''Validates the account profiles to monitor (--accounts flag) and returns their names.'''
+
+	profiles = CONFIG_DATA.get("accounts")
+	if not isinstance(profiles, dict) or len(profiles) == 0:
+		print("No account profiles found under the `accounts` key in config.txt. Exiting.")
+		sys.exit(1)
+
+	names = [name.strip() for name in names.split(",") if name.strip()] if names else list(profiles)
+	for name in names:
+		if name not in profiles:
+			print(f"No account named `{name}` in config.txt. Exiting.")
+			sys.exit(1)
+		if re.search("^[A-Za-z0-9_-]+$", name) is None:
+			print(f"Account names may only use letters, numbers, - and _ (got `{name}`). Exiting.")
+			sys.exit(1)
+		profile = profiles[name]
+		for key in ACCOUNT_KEYS:
+			profile.setdefault(key, "")
+		if profile["session_token"] == "": # would stop to ask for a login partway through monitoring
+			print(f"No session_token for account `{name}` in config.txt. Exiting.")
+			sys.exit(1)
+		if profile["acc_loc"] == "":
+			profile["acc_loc"] = CONFIG_DATA["acc_loc"] # same language as the main account unless set
+		if len(profile["api_key"]) != 43 and profile["api_key"] != "skip":
+			print(f"Invalid stat.ink API key for account `{name}` in config.txt. Exiting.")
+			sys.exit(1)
+	return names
 
 
 def headbutt(forcelang=None):
@@ -106,11 +234,25 @@ def headbutt(forcelang=None):
 		'Origin':           iksm.SPLATNET3_URL,
 		'X-Requested-With': 'com.nintendo.znca',
 		'Referer':          f'{iksm.SPLATNET3_URL}?lang={lang}&na_country={country}&na_lang={lang}',
-		'Accept-Encoding':  'gzip, deflate'
+		'Accept-Encoding':  ACCEPT_ENCODING.replace(",", ", ")
 	}
 	return graphql_head
 
 
+def graphql_post(body, priority, forcelang=None):
+	'''POSTs a GraphQL query to SplatNet 3 once it's this request's turn (see utils.PriorityGate), returning the response.'''
+
+	with SPLATNET_GATE.slot(priority) as waited:
+		name = PRIORITY_NAMES[priority]
+		with transfer_lock:
+			stats = QUEUE_WAITS.setdefault(name, [0, 0.0, 0.0])
+			stats[0] += 1
+			stats[1] += waited
+			stats[2] = max(stats[2], waited)
+		METRICS.observe("splatnet_queue_wait_seconds", waited, priority=name)
+		return SESSION.post(iksm.GRAPHQL_URL, data=body, headers=headbutt(forcelang=forcelang), cookies=dict(_gtoken=GTOKEN))
+
+
 def prefetch_checks(printout=False):
 	'''Queries the SplatNet 3 homepage to check if our gtoken & bulletToken are still valid and regenerates them if not.'''
 
@@ -123,12 +265,14 @@ def prefetch_checks(printout=False):
 		gen_new_tokens("blank")
 
 	sha = utils.translate_rid["HomeQuery"]
-	test = requests.post(iksm.GRAPHQL_URL, data=utils.gen_graphql_body(sha, "naCountry", USER_COUNTRY), headers=headbutt(), cookies=dict(_gtoken=GTOKEN))
+	test = graphql_post(utils.gen_graphql_body(sha, "naCountry", USER_COUNTRY), PRIORITY_HOUSEKEEPING)
 	if test.status_code != 200:
 		if printout:
 			print("\n")
 		gen_new_tokens("expiry")
 	else:
+		global TOKENS_VALIDATED_AT
+		TOKENS_VALIDATED_AT = int(time.time())
 		if printout:
 			print("Validating your tokens... done.\n")
 
@@ -159,7 +303,7 @@ def gen_new_tokens(reason, force=False):
 			manual_entry = True
 		else:
 			print("\nWrote session_token to config.txt.")
-		CONFIG_DATA["session_token"] = new_token
+		account_config()["session_token"] = new_token
 		write_config(CONFIG_DATA)
 	elif SESSION_TOKEN == "skip":
 		manual_entry = True
@@ -174,15 +318,19 @@ def gen_new_tokens(reason, force=False):
 		print("Attempting to generate new gtoken and bulletToken...")
 		new_gtoken, acc_name, acc_lang, acc_country = iksm.get_gtoken(F_GEN_URL, SESSION_TOKEN, A_VERSION)
 		new_bullettoken = iksm.get_bullet(new_gtoken, APP_USER_AGENT, acc_lang, acc_country)
-	CONFIG_DATA["gtoken"] = new_gtoken # valid for 6 hours
-	CONFIG_DATA["bullettoken"] = new_bullettoken # valid for 2 hours
+	account = account_config()
+	account["gtoken"] = new_gtoken # valid for 6 hours
+	account["bullettoken"] = new_bullettoken # valid for 2 hours
 
 	global USER_LANG
 	if acc_lang != USER_LANG:
 		acc_lang = USER_LANG
-	CONFIG_DATA["acc_loc"] = f"{acc_lang}|{acc_country}"
+	account["acc_loc"] = f"{acc_lang}|{acc_country}"
 
 	write_config(CONFIG_DATA)
+	global TOKENS_VALIDATED_AT
+	TOKENS_VALIDATED_AT = int(time.time())
+	METRICS.inc("token_refreshes_total", account=account_label())
 
 	if new_bullettoken == "":
 		print("Wrote gtoken to config.txt, but could not generate bulletToken.")
@@ -194,9 +342,15 @@ def gen_new_tokens(reason, force=False):
 		print(f"Wrote tokens for {acc_name} to config.txt.\n")
 
 
-def fetch_json(which, separate=False, exportall=False, specific=False, numbers_only=False, printout=False, skipprefetch=False):
+def fetch_json(which, separate=False, exportall=False, specific=False, numbers_only=False, printout=False, skipprefetch=False, heads=None, skip_ids=None, on_result=None):
 	'''Returns results JSON from SplatNet 3, including a combined dictionary for battles + SR jobs if requested.'''
 
+	# heads (monitoring mode): {stream: {"peek", "newest"}} from the last call, updated in place. only results newer
+	# than the last call's are returned, and a listing that hasn't changed at all isn't even parsed
+	# skip_ids (-o): compact IDs (utils.compact_id()) of results that are already exported, so their details aren't fetched
+	# on_result (-o): called with each full result as soon as it arrives - the details aren't kept then, and the IDs of
+	# the results that were handed over are returned in their place
+
 	swim = SquidProgress()
 
 	if DEBUG:
@@ -216,8 +370,20 @@ def fetch_json(which, separate=False, exportall=False, specific=False, numbers_o
 			print("* skipping prefetch_checks()")
 	swim()
 
+	# exports keep everything until the end, so they're buffered within a memory ceiling - see archive.ResultBuffer
+	buffer = None
+	if exportall:
+		try:
+			buffer_mb = float(CONFIG_DATA.get("result_buffer_mb", RESULT_BUFFER_MB))
+		except ValueError:
+			print(f"(!) result_buffer_mb in config.txt must be a number. Using {RESULT_BUFFER_MB}.")
+			buffer_mb = RESULT_BUFFER_MB
+		buffer = archive.ResultBuffer(int(buffer_mb * 1024 * 1024))
+	new_list = buffer.child if buffer is not None else list
+
 	ink_list, salmon_list = [], []
-	parent_files = []
+	ink_runs, salmon_runs = [], [] # per-query detail lists, merged in order at the end
+	parent_files = new_list()
 
 	queries = []
 	if which in ("both", "ink"):
@@ -242,6 +408,11 @@ def fetch_json(which, separate=False, exportall=False, specific=False, numbers_o
 	else:
 		queries.append(None)
 
+	# drop excluded results (private, user-defined mode/rule/date filters) before fetching any details
+	# exports keep everything that was queried
+	result_filters = [] if exportall else utils.build_result_filters(CONFIG_DATA)
+	priority = PRIORITY_BACKFILL if specific or exportall else PRIORITY_RESULT # -r/-o look at everything, not just the latest
+
 	needs_sorted = False # https://ygdp.yale.edu/phenomena/needs-washed :D
 
 	for sha in queries:
@@ -252,109 +423,156 @@ def fetch_json(which, separate=False, exportall=False, specific=False, numbers_o
 			sha = utils.translate_rid[sha]
 			battle_ids, job_ids = [], []
 
-			query1 = requests.post(iksm.GRAPHQL_URL,
-				data=utils.gen_graphql_body(sha),
-				headers=headbutt(forcelang=lang),
-				cookies=dict(_gtoken=GTOKEN))
-			query1_resp = json.loads(query1.text)
+			query1 = graphql_post(utils.gen_graphql_body(sha), priority, forcelang=lang)
 			swim()
 
+			stream = "ink" if lang is None else "salmon"
+			head, peek = None, None
+			if heads is not None and not specific and query1.status_code == 200:
+				head = heads.get(stream)
+				peek = utils.peek_first_id(query1.text)
+				if head is not None and peek is not None and peek == head["peek"]:
+					if DEBUG:
+						print(f"* no new {utils.set_noun(stream)} - skipping parse")
+					continue # same newest result as last time - nothing to do
+
+			query1_resp = json.loads(query1.text)
+
 			if not query1_resp.get("data"): # catch error
 				print("\nSomething's wrong with one of the query hashes. Ensure s3s is up-to-date, and if this message persists, please open an issue on GitHub.")
 				sys.exit(1)
 
 			# ink battles - latest 50 of any type
 			if "latestBattleHistories" in query1_resp["data"]:
-				for battle_group in query1_resp["data"]["latestBattleHistories"]["historyGroups"]["nodes"]:
-					for battle in battle_group["historyDetails"]["nodes"]:
-						battle_ids.append(battle["id"]) # don't filter out private battles here - do that in post_result()
+				groups = query1_resp["data"]["latestBattleHistories"]["historyGroups"]["nodes"]
+				for battle_group, battle in utils.iter_history_nodes(groups, stop_at=head and head["newest"]):
+					if utils.passes_filters(result_filters, battle, battle_group, False): # private battles dropped here (& in post_result())
+						battle_ids.append(battle["id"])
 
 			# ink battles - latest 50 turf war
 			elif "regularBattleHistories" in query1_resp["data"]:
 				needs_sorted = True
 				for battle_group in query1_resp["data"]["regularBattleHistories"]["historyGroups"]["nodes"]:
 					for battle in battle_group["historyDetails"]["nodes"]:
-						battle_ids.append(battle["id"])
+						if utils.passes_filters(result_filters, battle, battle_group, False):
+							battle_ids.append(battle["id"])
 			# ink battles - latest 50 anarchy battles
 			elif "bankaraBattleHistories" in query1_resp["data"]:
 				needs_sorted = True
 				for battle_group in query1_resp["data"]["bankaraBattleHistories"]["historyGroups"]["nodes"]:
 					for battle in battle_group["historyDetails"]["nodes"]:
-						battle_ids.append(battle["id"])
+						if utils.passes_filters(result_filters, battle, battle_group, False):
+							battle_ids.append(battle["id"])
 			# ink battles - latest 50 x battles
 			elif "xBattleHistories" in query1_resp["data"]:
 				needs_sorted = True
 				for battle_group in query1_resp["data"]["xBattleHistories"]["historyGroups"]["nodes"]:
 					for battle in battle_group["historyDetails"]["nodes"]:
-						battle_ids.append(battle["id"])
+						if utils.passes_filters(result_filters, battle, battle_group, False):
+							battle_ids.append(battle["id"])
 			# ink battles - latest 50 challenge battles
 			elif "eventBattleHistories" in query1_resp["data"]:
 				needs_sorted = True
 				for battle_group in query1_resp["data"]["eventBattleHistories"]["historyGroups"]["nodes"]:
 					for battle in battle_group["historyDetails"]["nodes"]:
-						battle_ids.append(battle["id"])
+						if utils.passes_filters(result_filters, battle, battle_group, False):
+							battle_ids.append(battle["id"])
 			# ink battles - latest 50 private battles
 			elif "privateBattleHistories" in query1_resp["data"] \
 			and not utils.custom_key_exists("ignore_private", CONFIG_DATA):
 				needs_sorted = True
 				for battle_group in query1_resp["data"]["privateBattleHistories"]["historyGroups"]["nodes"]:
 					for battle in battle_group["historyDetails"]["nodes"]:
-						battle_ids.append(battle["id"])
+						if utils.passes_filters(result_filters, battle, battle_group, False):
+							battle_ids.append(battle["id"])
 
 			# salmon run jobs - latest 50
 			elif "coopResult" in query1_resp["data"]:
-				for shift in query1_resp["data"]["coopResult"]["historyGroups"]["nodes"]:
-					for job in shift["historyDetails"]["nodes"]:
+				groups = query1_resp["data"]["coopResult"]["historyGroups"]["nodes"]
+				for shift, job in utils.iter_history_nodes(groups, stop_at=head and head["newest"]):
+					if utils.passes_filters(result_filters, job, shift, True):
 						job_ids.append(job["id"])
 
+			if peek is not None: # remember where this listing starts for next time
+				newest = next(utils.iter_history_nodes(groups), (None, {"id": None}))[1]["id"]
+				if head is not None and head["newest"] is not None and newest is not None \
+				and not any(node["id"] == head["newest"] for _, node in utils.iter_history_nodes(groups)):
+					# the newest result from last time has dropped out of splatnet's 50
+					print(f"\n(!) Some {utils.set_noun(stream)} may have been missed while s3s wasn't checking. " \
+						"Run s3s with " + '\033[91m' + "-r" + '\033[0m' + " to check for them.")
+					heads[stream] = {"peek": peek, "newest": newest, "missed": True}
+				else:
+					heads[stream] = {"peek": peek, "newest": newest}
+
+			if skip_ids:
+				battle_ids = [battle_id for battle_id in battle_ids if utils.compact_id(battle_id) not in skip_ids]
+				job_ids    = [job_id for job_id in job_ids if utils.compact_id(job_id) not in skip_ids]
+
 			if numbers_only:
 				ink_list.extend(battle_ids)
 				salmon_list.extend(job_ids)
+			elif on_result is not None: # ALL DATA, each one passed on as it arrives
+				for is_vs_history, ids in ((True, battle_ids), (False, job_ids)):
+					for result in thread_pool.map(fetch_detailed_result, [is_vs_history]*len(ids), ids, [swim]*len(ids),
+						[priority]*len(ids)):
+						on_result(result)
+				ink_list.extend(battle_ids)
+				salmon_list.extend(job_ids)
 			else: # ALL DATA - TAKES A LONG TIME
-				ink_list.extend(thread_pool.map(fetch_detailed_result, [True]*len(battle_ids), battle_ids, [swim]*len(battle_ids)))
-
-				salmon_list.extend(thread_pool.map(fetch_detailed_result, [False]*len(job_ids), job_ids, [swim]*len(job_ids)))
-
-				if needs_sorted: # put regular/bankara/event/private in order, b/c exported in sequential chunks
-					try:
-						ink_list = [x for x in ink_list if x['data']['vsHistoryDetail'] is not None] # just in case
-						ink_list = sorted(ink_list, key=lambda d: d['data']['vsHistoryDetail']['playedTime'])
-					except:
-						print("(!) Exporting without sorting results.json")
-					try:
-						salmon_list = [x for x in salmon_list if x['data']['coopHistoryDetail'] is not None]
-						salmon_list = sorted(salmon_list, key=lambda d: d['data']['coopHistoryDetail']['playedTime'])
-					except:
-						print("(!) Exporting without sorting coop_results.json")
-			parent_files.append(query1_resp)
+				for detail_runs, is_vs_history, ids in ((ink_runs, True, battle_ids), (salmon_runs, False, job_ids)):
+					run = new_list()
+					for result, raw in thread_pool.map(fetch_detailed_result, [is_vs_history]*len(ids), ids, [swim]*len(ids),
+						[priority]*len(ids), [True]*len(ids)):
+						if buffer is not None:
+							run.append(result, raw)
+						else:
+							run.append(result)
+					detail_runs.append(run)
+			if buffer is not None:
+				parent_files.append(query1_resp, query1.content)
+			else:
+				parent_files.append(query1_resp)
 		else: # sha = None (we don't want to get the specified result type)
 			pass
 
+	def combine(runs, detail_key, filename):
+		# returned lazily, oldest first - the runs are read as the caller goes (and cleaned up with parent_files)
+		if needs_sorted: # put regular/bankara/event/private in order, b/c exported in sequential chunks
+			try:
+				return utils.merge_histories(runs, detail_key)
+			except (KeyError, TypeError):
+				print(f"(!) Exporting without sorting {filename}")
+		return (result for run in runs for result in run)
+
+	if not numbers_only and on_result is None:
+		ink_list = combine(ink_runs, "vsHistoryDetail", "results.json")
+		salmon_list = combine(salmon_runs, "coopHistoryDetail", "coop_results.json")
+		if DEBUG and buffer is not None and buffer.shared["file"] is not None:
+			spilled = sum(run.spilled for run in ink_runs + salmon_runs) + parent_files.spilled
+			print(f"* {spilled} response{'' if spilled == 1 else 's'} spilled to disk (see result_buffer_mb)")
+
 	if exportall:
 		return parent_files, ink_list, salmon_list
 	else:
 		if separate:
 			return ink_list, salmon_list
 		else:
-			combined = ink_list + salmon_list
+			combined = list(ink_list) + list(salmon_list)
 			return combined
 
 
-def fetch_detailed_result(is_vs_history, history_id, swim):
-	'''Helper function for fetch_json().'''
+def fetch_detailed_result(is_vs_history, history_id, swim, priority=PRIORITY_RESULT, with_raw=False):
+	'''Helper function for fetch_json(). Also returns the raw response if `with_raw`.'''
 
 	sha = "VsHistoryDetailQuery" if is_vs_history else "CoopHistoryDetailQuery"
 	varname = "vsResultId" if is_vs_history else "coopHistoryDetailId"
 	lang = None if is_vs_history else 'en-US'
 
-	query2 = requests.post(iksm.GRAPHQL_URL,
-		data=utils.gen_graphql_body(utils.translate_rid[sha], varname, history_id),
-		headers=headbutt(forcelang=lang),
-		cookies=dict(_gtoken=GTOKEN))
+	query2 = graphql_post(utils.gen_graphql_body(utils.translate_rid[sha], varname, history_id), priority, forcelang=lang)
 	query2_resp = json.loads(query2.text)
 
 	swim()
-	return query2_resp
+	return (query2_resp, query2.content) if with_raw else query2_resp
 
 
 def populate_gear_abilities(player):
@@ -397,7 +615,7 @@ def set_scoreboard(battle, tricolor=False):
 	our_team_players, their_team_players, third_team_players = [], [], []
 
 	for i, player in enumerate(battle["myTeam"]["players"]):
-		p_dict = {}
+		p_dict = utils.PlayerRecord()
 		p_dict["me"]              = "yes" if player["isMyself"] else "no"
 		p_dict["name"]            = player["name"]
 		try:
@@ -429,11 +647,11 @@ def set_scoreboard(battle, tricolor=False):
 			p_dict["crown"]          = "yes" if player.get("crown") == True else "no"
 
 			# https://github.com/fetus-hina/stat.ink/wiki/Spl3-API:-Battle-%EF%BC%8D-Post#gears-structure
-			gear_struct = {"headgear": {}, "clothing": {}, "shoes": {}}
+			gear_struct = utils.GearsRecord()
 			h_main, h_subs, c_main, c_subs, s_main, s_subs = populate_gear_abilities(player)
-			gear_struct["headgear"] = {"primary_ability": h_main, "secondary_abilities": h_subs}
-			gear_struct["clothing"] = {"primary_ability": c_main, "secondary_abilities": c_subs}
-			gear_struct["shoes"]    = {"primary_ability": s_main, "secondary_abilities": s_subs}
+			gear_struct["headgear"] = utils.GearRecord(primary_ability=h_main, secondary_abilities=h_subs)
+			gear_struct["clothing"] = utils.GearRecord(primary_ability=c_main, secondary_abilities=c_subs)
+			gear_struct["shoes"]    = utils.GearRecord(primary_ability=s_main, secondary_abilities=s_subs)
 			p_dict["gears"] = gear_struct
 		else:
 			p_dict["disconnected"]   = "yes"
@@ -442,7 +660,7 @@ def set_scoreboard(battle, tricolor=False):
 	team_nums = [0, 1] if tricolor else [0]
 	for team_num in team_nums:
 		for i, player in enumerate(battle["otherTeams"][team_num]["players"]):
-			p_dict = {}
+			p_dict = utils.PlayerRecord()
 			p_dict["me"]              = "no"
 			p_dict["name"]            = player["name"]
 			try:
@@ -473,11 +691,11 @@ def set_scoreboard(battle, tricolor=False):
 				p_dict["disconnected"]   = "no"
 				p_dict["crown"]          = "yes" if player.get("crown") == True else "no"
 
-				gear_struct = {"headgear": {}, "clothing": {}, "shoes": {}}
+				gear_struct = utils.GearsRecord()
 				h_main, h_subs, c_main, c_subs, s_main, s_subs = populate_gear_abilities(player)
-				gear_struct["headgear"] = {"primary_ability": h_main, "secondary_abilities": h_subs}
-				gear_struct["clothing"] = {"primary_ability": c_main, "secondary_abilities": c_subs}
-				gear_struct["shoes"]    = {"primary_ability": s_main, "secondary_abilities": s_subs}
+				gear_struct["headgear"] = utils.GearRecord(primary_ability=h_main, secondary_abilities=h_subs)
+				gear_struct["clothing"] = utils.GearRecord(primary_ability=c_main, secondary_abilities=c_subs)
+				gear_struct["shoes"]    = utils.GearRecord(primary_ability=s_main, secondary_abilities=s_subs)
 				p_dict["gears"] = gear_struct
 			else:
 				p_dict["disconnected"]   = "yes"
@@ -687,86 +905,67 @@ def prepare_battle_result(battle, ismonitoring, isblackout, overview_data=None):
 			except: # could be null in historical data
 				pass
 
-		battle_id         = base64.b64decode(battle["id"]).decode('utf-8')
-		battle_id_mutated = battle_id.replace("BANKARA", "RECENT") # normalize the ID, make work with -M and -r
-
 		if overview_data is None: # no passed in file with -i
-			overview_post = requests.post(iksm.GRAPHQL_URL,
-				data=utils.gen_graphql_body(utils.translate_rid["BankaraBattleHistoriesQuery"]),
-				headers=headbutt(),
-				cookies=dict(_gtoken=GTOKEN))
+			overview_post = graphql_post(utils.gen_graphql_body(utils.translate_rid["BankaraBattleHistoriesQuery"]), PRIORITY_LINEAGE)
 			try:
 				overview_data = [json.loads(overview_post.text)] # make the request in real-time in attempt to get rank, etc.
 			except:
 				overview_data = None
 				print("Failed to get recent Anarchy Battles. Proceeding without information on current rank.")
 		if overview_data is not None:
-			ranked_list = []
-			for screen in overview_data:
-				if "bankaraBattleHistories" in screen["data"]:
-					ranked_list = screen["data"]["bankaraBattleHistories"]["historyGroups"]["nodes"]
-					break
-				elif "latestBattleHistories" in screen["data"]: # early exports used this, and no bankaraMatchChallenge below
-					ranked_list = screen["data"]["latestBattleHistories"]["historyGroups"]["nodes"]
-					break
-			for parent in ranked_list: # groups in overview (anarchy tab) JSON/screen
-				for idx, child in enumerate(parent["historyDetails"]["nodes"]):
-
-					# same battle, different screens
-					overview_battle_id         = base64.b64decode(child["id"]).decode('utf-8')
-					overview_battle_id_mutated = overview_battle_id.replace("BANKARA", "RECENT")
-
-					if overview_battle_id_mutated == battle_id_mutated: # found the battle ID in the other file
-						full_rank = re.split('([0-9]+)', child["udemae"].lower())
-						was_s_plus_before = len(full_rank) > 1 # true if "before" rank is s+
-
-						payload["rank_before"] = full_rank[0]
-						if was_s_plus_before:
-							payload["rank_before_s_plus"] = int(full_rank[1])
-
-						# anarchy battle (series) - not open
-						if "bankaraMatchChallenge" in parent and parent["bankaraMatchChallenge"] is not None:
-
-							# rankedup = parent["bankaraMatchChallenge"]["isUdemaeUp"]
-							ranks = ["c-", "c", "c+", "b-", "b", "b+", "a-", "a", "a+", "s"] # s+ handled separately
-
-							# rank-up battle
-							if parent["bankaraMatchChallenge"]["isPromo"] == True:
-								payload["rank_up_battle"] = "yes"
-							else:
-								payload["rank_up_battle"] = "no"
-
-							if parent["bankaraMatchChallenge"]["udemaeAfter"] is not None:
-								if idx != 0:
-									payload["rank_after"] = payload["rank_before"]
-									if was_s_plus_before: # not a rank-up battle, so must be the same
-										payload["rank_after_s_plus"] = payload["rank_before_s_plus"]
-								else: # the battle where we actually ranked up
-									full_rank_after = re.split('([0-9]+)', parent["bankaraMatchChallenge"]["udemaeAfter"].lower())
-									payload["rank_after"] = full_rank_after[0]
-									if len(full_rank_after) > 1:
-										payload["rank_after_s_plus"] = int(full_rank_after[1])
-
-							if idx == 0: # for the most recent battle in the series only
-								# send overall win/lose count
-								payload["challenge_win"] = parent["bankaraMatchChallenge"]["winCount"]
-								payload["challenge_lose"] = parent["bankaraMatchChallenge"]["loseCount"]
-
-								# send exp change (gain)
-								if payload["rank_exp_change"] is None:
-									payload["rank_exp_change"] = parent["bankaraMatchChallenge"]["earnedUdemaePoint"]
-
-							if DEBUG:
-								print(f'* {battle["judgement"]} {idx}')
-								print(f'* rank_before: {payload["rank_before"]}')
-								print(f'* rank_after: {payload["rank_after"]}')
-								print(f'* rank up battle: {parent["bankaraMatchChallenge"]["isPromo"]}')
-								print(f'* is ranked up: {parent["bankaraMatchChallenge"]["isUdemaeUp"]}')
-								if idx == 0:
-									print(f'* rank_exp_change: {parent["bankaraMatchChallenge"]["earnedUdemaePoint"]}')
-								else:
-									print(f'* rank_exp_change: 0')
-						break # found the child ID, no need to continue
+			# same battle, different screens - look up by normalized ID
+			match = utils.index_overview(overview_data)["bankara"].get(utils.normalize_battle_id(battle["id"]))
+			if match is not None: # found the battle ID in the other file
+				parent, idx, child = match
+				full_rank = re.split('([0-9]+)', child["udemae"].lower())
+				was_s_plus_before = len(full_rank) > 1 # true if "before" rank is s+
+
+				payload["rank_before"] = full_rank[0]
+				if was_s_plus_before:
+					payload["rank_before_s_plus"] = int(full_rank[1])
+
+				# anarchy battle (series) - not open
+				if "bankaraMatchChallenge" in parent and parent["bankaraMatchChallenge"] is not None:
+
+					# rankedup = parent["bankaraMatchChallenge"]["isUdemaeUp"]
+					ranks = ["c-", "c", "c+", "b-", "b", "b+", "a-", "a", "a+", "s"] # s+ handled separately
+
+					# rank-up battle
+					if parent["bankaraMatchChallenge"]["isPromo"] == True:
+						payload["rank_up_battle"] = "yes"
+					else:
+						payload["rank_up_battle"] = "no"
+
+					if parent["bankaraMatchChallenge"]["udemaeAfter"] is not None:
+						if idx != 0:
+							payload["rank_after"] = payload["rank_before"]
+							if was_s_plus_before: # not a rank-up battle, so must be the same
+								payload["rank_after_s_plus"] = payload["rank_before_s_plus"]
+						else: # the battle where we actually ranked up
+							full_rank_after = re.split('([0-9]+)', parent["bankaraMatchChallenge"]["udemaeAfter"].lower())
+							payload["rank_after"] = full_rank_after[0]
+							if len(full_rank_after) > 1:
+								payload["rank_after_s_plus"] = int(full_rank_after[1])
+
+					if idx == 0: # for the most recent battle in the series only
+						# send overall win/lose count
+						payload["challenge_win"] = parent["bankaraMatchChallenge"]["winCount"]
+						payload["challenge_lose"] = parent["bankaraMatchChallenge"]["loseCount"]
+
+						# send exp change (gain)
+						if payload["rank_exp_change"] is None:
+							payload["rank_exp_change"] = parent["bankaraMatchChallenge"]["earnedUdemaePoint"]
+
+					if DEBUG:
+						print(f'* {battle["judgement"]} {idx}')
+						print(f'* rank_before: {payload["rank_before"]}')
+						print(f'* rank_after: {payload["rank_after"]}')
+						print(f'* rank up battle: {parent["bankaraMatchChallenge"]["isPromo"]}')
+						print(f'* is ranked up: {parent["bankaraMatchChallenge"]["isUdemaeUp"]}')
+						if idx == 0:
+							print(f'* rank_exp_change: {parent["bankaraMatchChallenge"]["earnedUdemaePoint"]}')
+						else:
+							print(f'* rank_exp_change: 0')
 
 	## X BATTLES ##
 	###############
@@ -775,40 +974,24 @@ def prepare_battle_result(battle, ismonitoring, isblackout, overview_data=None):
 		if battle["xMatch"]["lastXPower"] is not None:
 			payload["x_power_before"] = battle["xMatch"]["lastXPower"]
 
-		battle_id         = base64.b64decode(battle["id"]).decode('utf-8')
-		battle_id_mutated = battle_id.replace("XMATCH", "RECENT")
-
 		if overview_data is None: # no passed in file with -i
-			overview_post = requests.post(iksm.GRAPHQL_URL,
-				data=utils.gen_graphql_body(utils.translate_rid["XBattleHistoriesQuery"]),
-				headers=headbutt(),
-				cookies=dict(_gtoken=GTOKEN))
+			overview_post = graphql_post(utils.gen_graphql_body(utils.translate_rid["XBattleHistoriesQuery"]), PRIORITY_LINEAGE)
 			try:
 				overview_data = [json.loads(overview_post.text)] # make the request in real-time in attempt to get rank, etc.
 			except:
 				overview_data = None
 				print("Failed to get recent X Battles. Proceeding without some information on X Power.")
 		if overview_data is not None:
-			x_list = []
-			for screen in overview_data:
-				if "xBattleHistories" in screen["data"]:
-					x_list = screen["data"]["xBattleHistories"]["historyGroups"]["nodes"]
-					break
-			for parent in x_list: # groups in overview (x tab) JSON/screen
-				for idx, child in enumerate(parent["historyDetails"]["nodes"]):
-
-					overview_battle_id         = base64.b64decode(child["id"]).decode('utf-8')
-					overview_battle_id_mutated = overview_battle_id.replace("XMATCH", "RECENT")
+			match = utils.index_overview(overview_data)["x"].get(utils.normalize_battle_id(battle["id"]))
+			if match is not None:
+				parent, idx, child = match
+				if idx == 0:
+					# best of 5 for getting x power at season start, best of 3 after
+					payload["challenge_win"] = parent["xMatchMeasurement"]["winCount"]
+					payload["challenge_lose"] = parent["xMatchMeasurement"]["loseCount"]
 
-					if overview_battle_id_mutated == battle_id_mutated:
-						if idx == 0:
-							# best of 5 for getting x power at season start, best of 3 after
-							payload["challenge_win"] = parent["xMatchMeasurement"]["winCount"]
-							payload["challenge_lose"] = parent["xMatchMeasurement"]["loseCount"]
-
-							if parent["xMatchMeasurement"]["state"] == "COMPLETED":
-								payload["x_power_after"] = parent["xMatchMeasurement"]["xPowerAfter"]
-							break
+					if parent["xMatchMeasurement"]["state"] == "COMPLETED":
+						payload["x_power_after"] = parent["xMatchMeasurement"]["xPowerAfter"]
 
 	## CHALLENGES ##
 	################
@@ -934,10 +1117,9 @@ def prepare_job_result(job, ismonitoring, isblackout, overview_data=None, prevre
 						except KeyError: # prev job was private or disconnect
 							pass
 			else:
-				prev_job_post = requests.post(iksm.GRAPHQL_URL,
-					data=utils.gen_graphql_body(utils.translate_rid["CoopHistoryDetailQuery"], "coopHistoryDetailId", prev_job_id),
-					headers=headbutt(forcelang='en-US'),
-					cookies=dict(_gtoken=GTOKEN))
+				prev_job_post = graphql_post(
+					utils.gen_graphql_body(utils.translate_rid["CoopHistoryDetailQuery"], "coopHistoryDetailId", prev_job_id),
+					PRIORITY_LINEAGE, forcelang='en-US')
 				try:
 					prev_job = json.loads(prev_job_post.text)
 
@@ -994,7 +1176,7 @@ def prepare_job_result(job, ismonitoring, isblackout, overview_data=None, prevre
 		players_json.append(teammate)
 
 	for i, player in enumerate(players_json):
-		player_info = {}
+		player_info = utils.JobPlayerRecord()
 		player_info["me"]              = "yes" if i == 0 else "no"
 		player_info["name"]            = player["player"]["name"]
 		player_info["number"]          = player["player"]["nameId"]
@@ -1054,7 +1236,7 @@ def prepare_job_result(job, ismonitoring, isblackout, overview_data=None, prevre
 
 	waves = []
 	for i, wave in enumerate(job["waveResults"]):
-		wave_info = {}
+		wave_info = utils.WaveRecord()
 		wave_info["tide"]               = "low" if wave["waterLevel"] == 0 else "high" if wave["waterLevel"] == 2 else "normal"
 		wave_info["golden_quota"]       = wave["deliverNorm"]
 		wave_info["golden_delivered"]   = wave["teamDeliverCount"]
@@ -1149,11 +1331,11 @@ def prepare_job_result(job, ismonitoring, isblackout, overview_data=None, prevre
 	for boss in job["enemyResults"]:
 		boss_id  = utils.b64d(boss["enemy"]["id"])
 		boss_key = translate_boss[boss_id]
-		bosses[boss_key] = {
-			"appearances":    boss["popCount"],
-			"defeated":       boss["teamDefeatCount"],
-			"defeated_by_me": boss["defeatCount"]
-		}
+		bosses[boss_key] = utils.BossRecord(
+			appearances    = boss["popCount"],
+			defeated       = boss["teamDefeatCount"],
+			defeated_by_me = boss["defeatCount"]
+		)
 	payload["bosses"] = bosses
 
 	payload["start_at"] = utils.epoch_time(job["playedTime"])
@@ -1178,13 +1360,72 @@ def prepare_job_result(job, ismonitoring, isblackout, overview_data=None, prevre
 	return payload
 
 
+def slim_payload(payload, detail, profile):
+	'''Replaces a payload's splatnet_json with a slimmed version (see utils.PAYLOAD_PROFILES). Returns the # of bytes saved.'''
+
+	full_json = payload["splatnet_json"]
+	slim_json = utils.slim_json(detail, profile)
+
+	# only splatnet_json is replaced, and the slimmed json must still describe the same result
+	if json.loads(slim_json).get("id") != detail.get("id"):
+		print(f"(!) Could not slim payload using the '{profile}' profile. Uploading it in full.")
+		return 0
+
+	payload["splatnet_json"] = slim_json
+	return len(full_json.encode('utf-8')) - len(slim_json.encode('utf-8'))
+
+
+def upload_payload(url, packed_payload, api_key=None):
+	'''POSTs a msgpack payload to stat.ink, gzipping the body if compress_uploads is on & the server hasn't refused it.'''
+
+	global UPLOAD_COMPRESSION
+	auth = {'Authorization': f'Bearer {api_key or API_KEY}', 'Content-Type': 'application/x-msgpack'}
+
+	with transfer_lock: # also flipped from the outbox drainer's thread
+		compress = UPLOAD_COMPRESSION
+	if compress:
+		compressed = gzip.compress(packed_payload)
+		postbattle = SESSION.post(url, headers=dict(auth, **{'Content-Encoding': 'gzip'}), data=compressed, allow_redirects=False)
+		if upload_outcome(postbattle) != "rejected": # accepted, or worth retrying as-is later (5xx, 429...)
+			with transfer_lock:
+				TRANSFER_STATS["sent_saved"] += len(packed_payload) - len(compressed)
+			return postbattle
+		METRICS.inc("upload_retries_total", reason="compression")
+		# there's no telling a body stat.ink couldn't decode from a result it didn't like, so any rejection is tried again
+		# uncompressed - and if that goes through, compression is what it didn't like
+		postbattle = SESSION.post(url, headers=auth, data=packed_payload, allow_redirects=False)
+		if upload_outcome(postbattle) == "ok":
+			if DEBUG:
+				print("* stat.ink refused a compressed upload; sending uncompressed from now on")
+			with transfer_lock:
+				UPLOAD_COMPRESSION = False
+		return postbattle
+
+	return SESSION.post(url, headers=auth, data=packed_payload, allow_redirects=False)
+
+
+def upload_outcome(postbattle):
+	'''Sorts a stat.ink upload response into "ok", "retry" (might work later) or "rejected" (won't ever work).'''
+
+	if postbattle.status_code in (200, 201):
+		return "ok"
+	elif postbattle.status_code in (408, 429) or postbattle.status_code >= 500:
+		return "retry"
+	return "rejected"
+
+
 def post_result(data, ismonitoring, isblackout, istestrun, overview_data=None):
-	'''Uploads battle/job JSON to stat.ink, and prints the returned URL or error message.'''
+	'''Uploads battle/job JSON to stat.ink, and prints the returned URL or error message. Returns the IDs stat.ink accepted.'''
 
 	if len(API_KEY) != 43:
 		print("Cannot post to stat.ink without a valid API key set in config.txt. Exiting.")
 		sys.exit(0)
 
+	profile = CONFIG_DATA.get("payload_profile", "full")
+	if profile not in utils.PAYLOAD_PROFILES:
+		print(f"(!) Unknown payload_profile '{profile}' in config.txt. Uploading full payloads.")
+		profile = "full"
+
 	if isinstance(data, list): # -o export format
 		try:
 			data = [x for x in data if x["data"]["vsHistoryDetail"] is not None] # avoid {"data": {"vsHistoryDetail": None}} error
@@ -1201,24 +1442,27 @@ def post_result(data, ismonitoring, isblackout, istestrun, overview_data=None):
 			results = data["results"]
 		except KeyError:
 			results = [data] # single battle/job - make into a list
+	else: # already in chronological order & read lazily - streaming -i, --db, or straight from a merge
+		results = data
 
 	# filter down to one battle at a time
-	for i in range(len(results)):
-		if "vsHistoryDetail" in results[i]["data"]: # ink battle
-			payload = prepare_battle_result(results[i]["data"], ismonitoring, isblackout, overview_data)
+	previous, accepted = None, []
+	for result in results:
+		prevresult, previous = (previous["data"] if previous else None), result
+		if "vsHistoryDetail" in result["data"]: # ink battle
+			payload = prepare_battle_result(result["data"], ismonitoring, isblackout, overview_data)
 			which = "ink"
-		elif "coopHistoryDetail" in results[i]["data"]: # salmon run job
-			prevresult = results[i-1]["data"] if i > 0 else None
-			payload = prepare_job_result(results[i]["data"], ismonitoring, isblackout, overview_data, prevresult=prevresult)
+		elif "coopHistoryDetail" in result["data"]: # salmon run job
+			payload = prepare_job_result(result["data"], ismonitoring, isblackout, overview_data, prevresult=prevresult)
 			which = "salmon"
 		else: # shouldn't happen
 			print("Ill-formatted JSON while uploading. Exiting.")
 			print('\nDebug info:')
-			print(json.dumps(results))
+			print(json.dumps(result))
 			sys.exit(1) # always exit here - something is seriously wrong
 
 		if not payload: # empty payload
-			return
+			return accepted
 
 		if len(payload) == 0: # received blank payload from prepare_job_result() - skip unsupported battle
 			continue
@@ -1239,14 +1483,35 @@ def post_result(data, ismonitoring, isblackout, istestrun, overview_data=None):
 		if istestrun:
 			payload["test"] = "yes"
 
+		saved = 0
+		if profile != "full":
+			saved = slim_payload(payload, result["data"]["vsHistoryDetail" if which == "ink" else "coopHistoryDetail"], profile)
+
 		# POST
 		url = "https://stat.ink/api/v3"
 		if which == "ink":
 			url += "/battle"
 		elif which == "salmon":
 			url += "/salmon"
-		auth = {'Authorization': f'Bearer {API_KEY}', 'Content-Type': 'application/x-msgpack'}
-		postbattle = requests.post(url, headers=auth, data=msgpack.packb(payload), allow_redirects=False)
+		packed_payload = msgpack.packb(payload, default=utils.pack_record)
+		if saved:
+			with transfer_lock:
+				TRANSFER_STATS["slimmed"] += saved
+			if DEBUG:
+				size_before, size_after = len(packed_payload) + saved, len(packed_payload)
+				print(f"* payload size: {size_before:,} -> {size_after:,} bytes ({profile}, {100 - 100*size_after//size_before}% smaller)")
+		noun = utils.set_noun(which)[:-1]
+
+		# saved first, and only removed once stat.ink has it - see outbox.py
+		outbox_key = None if istestrun else OUTBOX.put(which, payload["uuid"], packed_payload, ACTIVE_ACCOUNT)
+		try:
+			postbattle = upload_payload(url, packed_payload)
+		except requests.exceptions.RequestException as e:
+			if outbox_key is None:
+				raise
+			OUTBOX.record_failure(outbox_key, e)
+			print(f"Could not reach stat.ink. Saved the {noun} to the outbox to upload later.")
+			continue
 
 		# response
 		headerloc = postbattle.headers.get('location')
@@ -1256,7 +1521,15 @@ def post_result(data, ismonitoring, isblackout, istestrun, overview_data=None):
 		except KeyError:
 			time_uploaded = None
 		except json.decoder.JSONDecodeError: # retry once
-			postbattle = requests.post(url, headers=auth, data=msgpack.packb(payload), allow_redirects=False)
+			METRICS.inc("upload_retries_total", reason="bad_response")
+			try:
+				postbattle = upload_payload(url, packed_payload)
+			except requests.exceptions.RequestException as e:
+				if outbox_key is None:
+					raise
+				OUTBOX.record_failure(outbox_key, e)
+				print(f"Could not reach stat.ink. Saved the {noun} to the outbox to upload later.")
+				continue
 			headerloc = postbattle.headers.get('location')
 			time_now = int(time.time())
 			try:
@@ -1265,8 +1538,8 @@ def post_result(data, ismonitoring, isblackout, istestrun, overview_data=None):
 				print("Error with stat.ink. Please try again.")
 
 		detail_type = "vsHistoryDetail" if which == "ink" else "coopHistoryDetail"
-		result_id = results[i]["data"][detail_type]["id"]
-		noun = utils.set_noun(which)[:-1]
+		result_id = result["data"][detail_type]["id"]
+		METRICS.inc("uploads_total", account=account_label(), type=noun, status=postbattle.status_code)
 
 		if DEBUG:
 			print(f"* time uploaded: {time_uploaded}; time now: {time_now}")
@@ -1285,6 +1558,121 @@ def post_result(data, ismonitoring, isblackout, istestrun, overview_data=None):
 		else: # 200 OK
 			print(f"{noun.capitalize()} uploaded to {headerloc}")
 
+		outcome = upload_outcome(postbattle)
+		if outcome == "ok" and not istestrun:
+			accepted.append(result_id)
+		if outbox_key is not None:
+			if outcome == "ok":
+				OUTBOX.remove(outbox_key)
+			else:
+				OUTBOX.record_failure(outbox_key, f"HTTP {postbattle.status_code}: {postbattle.text[:200]}",
+					permanent=(outcome == "rejected"))
+				if outcome == "retry":
+					print(f"Saved the {noun} to the outbox to upload later.")
+
+	return accepted
+
+
+def drain_outbox(printout=False):
+	'''Retries the queued stat.ink uploads that are due, oldest first. Returns how many are still waiting.'''
+
+	for key, item in OUTBOX.pending(due_only=True):
+		account = item["account"]
+		if "uuid" in item and OUTBOX.key(item["which"], item["uuid"], account) != key: # not what was queued here
+			OUTBOX.record_failure(key, f"queued for account {account} under another account's name", permanent=True)
+			continue
+		try:
+			api_key = (CONFIG_DATA if account is None else CONFIG_DATA["accounts"][account])["api_key"]
+		except KeyError:
+			OUTBOX.record_failure(key, f"no account named {account} in config.txt", permanent=True)
+			continue
+
+		noun = "battle" if item["which"] == "ink" else "job"
+		url = "https://stat.ink/api/v3" + ("/battle" if item["which"] == "ink" else "/salmon")
+		try:
+			postbattle = upload_payload(url, item["payload"], api_key=api_key)
+		except requests.exceptions.RequestException as e:
+			OUTBOX.record_failure(key, e)
+			METRICS.inc("outbox_retries_total", outcome="retry")
+			break # still can't reach stat.ink - the rest can wait too
+
+		outcome = upload_outcome(postbattle)
+		METRICS.inc("outbox_retries_total", outcome=outcome)
+		if outcome == "ok":
+			OUTBOX.remove(key)
+			if printout:
+				print(f"Uploaded a queued {noun} to {postbattle.headers.get('location')}")
+		else:
+			OUTBOX.record_failure(key, f"HTTP {postbattle.status_code}: {postbattle.text[:200]}", permanent=(outcome == "rejected"))
+			if printout:
+				print(f"Could not upload a queued {noun} (HTTP {postbattle.status_code})" + \
+					(" - moved to outbox/failed/." if outcome == "rejected" else "; will retry later."))
+			if outcome == "retry":
+				break
+
+	remaining = len(OUTBOX)
+	METRICS.set("outbox_pending", remaining)
+	return remaining
+
+
+def start_outbox_drainer(interval=60):
+	'''Retries queued uploads from a background thread, e.g. while monitoring.'''
+
+	def drain_forever():
+		while True:
+			time.sleep(interval)
+			try:
+				drain_outbox(printout=True)
+			except Exception as e: # keep going - it's only a retry
+				if DEBUG:
+					print(f"* outbox drainer error: {e}")
+
+	threading.Thread(target=drain_forever, name="s3s-outbox", daemon=True).start()
+
+
+def manage_outbox(command):
+	'''Lists the queued & rejected uploads, or retries all of them right away (--outbox flag).'''
+
+	fmt_time = lambda t: datetime.datetime.fromtimestamp(t).strftime('%Y-%m-%d %I:%M:%S %p')
+	if command == "flush":
+		for key, _ in OUTBOX.pending() + OUTBOX.pending(failed=True):
+			OUTBOX.release(key)
+		remaining = drain_outbox(printout=True)
+		print(f"{remaining} upload{'' if remaining == 1 else 's'} still in the outbox.")
+		return
+
+	for title, items in (("Waiting to upload", OUTBOX.pending()), ("Rejected by stat.ink", OUTBOX.pending(failed=True))):
+		print(f"{title}: {len(items)}")
+		for key, item in items:
+			print(f"  {key} - queued {fmt_time(item['created'])}, {item['attempts']} attempt{'' if item['attempts'] == 1 else 's'}" + \
+				(f", next try {fmt_time(item['next_try'])}" if title.startswith("Waiting") else "") + \
+				(f" [{item['account']}]" if item["account"] else ""))
+			if item["last_error"]:
+				print(f"    last error: {item['last_error']}")
+
+
+def print_transfer_report():
+	'''Prints how many bytes were sent & received this run, and how much compression saved (registered with atexit).'''
+
+	stats = dict(TRANSFER_STATS)
+	if stats["sent"] + stats["received"] == 0:
+		return
+	kb = lambda n: f"{n/1024:,.1f} KB"
+	print(f"\nData transferred: {kb(stats['sent'])} sent ({kb(stats['sent_saved'])} saved by compression" + \
+		(f", {kb(stats['slimmed'])} by payload_profile" if stats["slimmed"] else "") + "), " \
+		f"{kb(stats['received'])} received ({kb(stats['received_decoded'])} decoded).")
+	if DEBUG:
+		for name, (count, total, longest) in queue_wait_report().items():
+			print(f"* SplatNet queue wait ({name}): {count} request{'' if count == 1 else 's'}, " \
+				f"{total/count:.2f}s average, {longest:.2f}s longest")
+
+
+def queue_wait_report():
+	'''Returns how long SplatNet requests have waited for their turn, per priority.'''
+
+	with transfer_lock:
+		return {name: list(stats) for name, stats in QUEUE_WAITS.items()}
+
 
 def check_for_updates():
 	'''Checks the script version against the repo, reminding users to update if available.'''
@@ -1395,7 +1783,7 @@ def get_num_results(which):
 		return n
 
 
-def fetch_and_upload_single_result(hash_, noun, isblackout, istestrun):
+def fetch_and_upload_single_result(hash_, noun, isblackout, istestrun, priority=PRIORITY_RESULT):
 	'''Performs a GraphQL request for a single vsResultId/coopHistoryDetailId and call post_result().'''
 
 	if noun in ("battles", "battle"):
@@ -1407,18 +1795,12 @@ def fetch_and_upload_single_result(hash_, noun, isblackout, istestrun):
 		dict_key2 = "coopHistoryDetailId"
 		lang = 'en-US'
 
-	result_post = requests.post(iksm.GRAPHQL_URL,
-			data=utils.gen_graphql_body(utils.translate_rid[dict_key], dict_key2, hash_),
-			headers=headbutt(forcelang=lang),
-			cookies=dict(_gtoken=GTOKEN))
+	result_post = graphql_post(utils.gen_graphql_body(utils.translate_rid[dict_key], dict_key2, hash_), priority, forcelang=lang)
 	try:
 		result = json.loads(result_post.text)
 		post_result(result, False, isblackout, istestrun) # not monitoring mode
 	except json.decoder.JSONDecodeError: # retry once, hopefully avoid a few errors
-		result_post = requests.post(iksm.GRAPHQL_URL,
-				data=utils.gen_graphql_body(utils.translate_rid[dict_key], dict_key2, hash_),
-				headers=headbutt(forcelang=lang),
-				cookies=dict(_gtoken=GTOKEN))
+		result_post = graphql_post(utils.gen_graphql_body(utils.translate_rid[dict_key], dict_key2, hash_), priority, forcelang=lang)
 		try:
 			result = json.loads(result_post.text)
 			post_result(result, False, isblackout, istestrun)
@@ -1455,7 +1837,7 @@ def check_if_missing(which, isblackout, istestrun, skipprefetch):
 		if url is not None:
 			printed = False
 			auth = {'Authorization': f'Bearer {API_KEY}'}
-			resp = requests.get(url, headers=auth)
+			resp = SESSION.get(url, headers=auth)
 			try:
 				statink_uploads = json.loads(resp.text)
 			except:
@@ -1496,7 +1878,7 @@ def check_if_missing(which, isblackout, istestrun, skipprefetch):
 					printed = True
 					print(f"Previously-unuploaded {noun} detected. Uploading now...")
 
-				fetch_and_upload_single_result(id, noun, isblackout, istestrun)
+				fetch_and_upload_single_result(id, noun, isblackout, istestrun, PRIORITY_BACKFILL)
 
 			if not printed:
 				print(f"No previously-unuploaded {noun} found.")
@@ -1505,193 +1887,490 @@ def check_if_missing(which, isblackout, istestrun, skipprefetch):
 		which = "salmon"
 
 
-def check_for_new_results(which, cached_battles, cached_jobs, battle_wins, battle_losses, battle_draws, splatfest_wins, splatfest_losses, splatfest_draws, mirror_matches, job_successes, job_failures, isblackout, istestrun):
+def read_sync_state():
+	'''Returns the high-water marks saved by the last --sync run, or blank state.'''
+
+	try:
+		with open(SYNC_STATE_PATH) as state_file:
+			state = json.load(state_file)
+		if state.get("version") == 1:
+			return state
+	except (IOError, ValueError):
+		pass
+	return {"version": 1, "heads": {}, "last_full": {}, "tokens_validated_at": 0}
+
+
+def sync_results(which, isblackout, istestrun, skipprefetch, force_full=False):
+	'''Uploads only results newer than the last run's high-water mark, reconciling fully every so often (--sync flag).'''
+
+	# meant for cron/scheduled runs - when nothing's new, this is one request per result type (plus none to stat.ink)
+	state = read_sync_state()
+	streams = [stream for stream in ("ink", "salmon") if which in ("both", stream)]
+	try:
+		full_secs = float(CONFIG_DATA.get("sync_full_hours", 24)) * 3600
+	except ValueError:
+		print("(!) sync_full_hours in config.txt must be a number. Using 24.")
+		full_secs = 24 * 3600
+
+	global TOKENS_VALIDATED_AT
+	TOKENS_VALIDATED_AT = max(TOKENS_VALIDATED_AT, state["tokens_validated_at"])
+	tokens_fresh = skipprefetch or time.time() - TOKENS_VALIDATED_AT < TOKEN_RECHECK_SECS
+
+	now = int(time.time())
+	needs_full = force_full or any(stream not in state["heads"] or now - state["last_full"].get(stream, 0) >= full_secs
+		for stream in streams)
+
+	heads = {stream: head for stream, head in state["heads"].items() if not (needs_full and stream in streams)}
+	try:
+		ink_results, salmon_results = fetch_json(which, separate=True, numbers_only=True, skipprefetch=tokens_fresh, heads=heads)
+	except: # e.g. JSONDecodeError - tokens have probably expired
+		gen_new_tokens("expiry")
+		heads = {stream: head for stream, head in state["heads"].items() if not (needs_full and stream in streams)}
+		ink_results, salmon_results = fetch_json(which, separate=True, numbers_only=True, skipprefetch=True, heads=heads)
+	if any(heads.get(stream, {}).get("missed") for stream in streams):
+		print("Your last sync was more than 50 results ago.")
+		needs_full = True
+
+	if needs_full: # marks are set above, so anything newer gets picked up incrementally next time
+		print("Reconciling with stat.ink...")
+		check_if_missing(which, isblackout, istestrun, True)
+		for stream in streams:
+			state["last_full"][stream] = now
+	else:
+		if ink_results or salmon_results:
+			print("Uploading new results since the last sync...")
+		for hash_ in reversed(ink_results): # oldest first
+			fetch_and_upload_single_result(hash_, "battles", isblackout, istestrun)
+		for hash_ in reversed(salmon_results):
+			fetch_and_upload_single_result(hash_, "jobs", isblackout, istestrun)
+		if not ink_results and not salmon_results:
+			print(f"No new {utils.set_noun(which)} since the last sync.")
+
+	# only saved once everything's uploaded - if we exit early, the next run picks up from the old marks
+	for head in heads.values():
+		head.pop("missed", None)
+	state["heads"] = heads
+	state["tokens_validated_at"] = TOKENS_VALIDATED_AT
+	try:
+		utils.write_json_atomic(SYNC_STATE_PATH, state)
+	except OSError as e:
+		print(f"(!) Could not save the sync state: {e}")
+
+
+def new_counters():
+	'''Returns zeroed session counters for monitoring mode.'''
+
+	return {
+		"battle_wins": 0, "battle_losses": 0, "battle_draws": 0,
+		"splatfest_wins": 0, "splatfest_losses": 0, "splatfest_draws": 0, "mirror_matches": 0,
+		"job_successes": 0, "job_failures": 0
+	}
+
+
+def write_checkpoint(which, cached_battles, cached_jobs, cursors, counters):
+	'''Atomically saves monitoring state to disk, so a restarted -M session can resume without losing results.'''
+
+	checkpoint = {
+		"version":  1,
+		"which":    which,
+		"saved_at": int(time.time()),
+		"seen":     {"ink": cached_battles.to_list(), "salmon": cached_jobs.to_list()},
+		"cursors":  cursors,
+		"counters": counters,
+		"tokens_validated_at": TOKENS_VALIDATED_AT
+	}
+	try:
+		utils.write_json_atomic(CHECKPOINT_PATH, checkpoint)
+	except OSError as e:
+		if DEBUG:
+			print(f"* could not write checkpoint: {e}")
+
+
+def read_checkpoint():
+	'''Returns the saved monitoring state from a previous -M session (stopped or interrupted), or None.'''
+
+	try:
+		with open(CHECKPOINT_PATH) as checkpoint_file:
+			checkpoint = json.load(checkpoint_file)
+		if checkpoint.get("version") != 1:
+			return None
+		return checkpoint
+	except (IOError, ValueError):
+		return None
+
+
+def check_for_new_results(which, cached_battles, cached_jobs, counters, cursors, isblackout, istestrun):
 	'''Helper function for monitor_battles(), called every N seconds or when exiting.'''
 
 	# ! fetch from online
 	# check only numbers (quicker); specific=False since checks recent (latest) only
+	tokens_fresh = time.time() - TOKENS_VALIDATED_AT < TOKEN_RECHECK_SECS
+	# cheap change detection - see fetch_json(). fetch_json() moves the heads forward as it goes, so it gets a copy that's
+	# only kept once this cycle's results are all handled - if anything fails first, the next cycle sees them again
+	heads = dict(cursors.get("heads", {}))
+	poll_start = time.time()
 	try:
-		ink_results, salmon_results = fetch_json(which, separate=True, numbers_only=True)
+		ink_results, salmon_results = fetch_json(which, separate=True, numbers_only=True, skipprefetch=tokens_fresh, heads=heads)
 	except: # e.g. JSONDecodeError - tokens have probably expired
+		METRICS.inc("poll_retries_total", account=account_label())
 		gen_new_tokens("expiry") # we don't have to do prefetch_checks(), we know they're expired. gen new ones and try again
-		ink_results, salmon_results = fetch_json(which, separate=True, numbers_only=True)
-	foundany = False
+		heads = dict(cursors.get("heads", {}))
+		ink_results, salmon_results = fetch_json(which, separate=True, numbers_only=True, heads=heads)
+	METRICS.observe("poll_seconds", time.time() - poll_start, account=account_label(), which=which)
+	found = {"ink": False, "salmon": False}
 
+	# new results, oldest first across battles & jobs
+	new_results = []
 	if which in ("both", "ink"):
-		for num in reversed(ink_results):
-			if num not in cached_battles:
-				# get the full battle data
-				result_post = requests.post(iksm.GRAPHQL_URL,
-					data=utils.gen_graphql_body(utils.translate_rid["VsHistoryDetailQuery"], "vsResultId", num),
-					headers=headbutt(),
-					cookies=dict(_gtoken=GTOKEN))
-				result = json.loads(result_post.text)
-
-				if result["data"]["vsHistoryDetail"]["vsMode"]["mode"] == "PRIVATE" \
-				and utils.custom_key_exists("ignore_private", CONFIG_DATA):
-					pass
+		new_results.extend((True, num) for num in reversed(ink_results) if num not in cached_battles)
+	if which in ("both", "salmon"):
+		new_results.extend((False, num) for num in reversed(salmon_results) if num not in cached_jobs)
+	new_results.sort(key=lambda r: utils.id_epoch_time(r[1]) or 0) # stable, so ties keep listing order
+
+	# fetch all the full results in the background while earlier ones are converted & uploaded, in order
+	no_swim = lambda: None
+	pending = [thread_pool.submit(fetch_detailed_result, is_vs_history, num, no_swim) for is_vs_history, num in new_results]
+
+	for (is_vs_history, num), future in zip(new_results, pending):
+		result = future.result()
+
+		if is_vs_history:
+			if result["data"]["vsHistoryDetail"]["vsMode"]["mode"] == "PRIVATE" \
+			and utils.custom_key_exists("ignore_private", CONFIG_DATA):
+				pass
+			else:
+				found["ink"] = True
+				METRICS.inc("results_detected_total", account=account_label(), type="battle")
+				if result["data"]["vsHistoryDetail"]["judgement"] == "WIN":
+					outcome = "Victory"
+				elif result["data"]["vsHistoryDetail"]["judgement"] in ("LOSE", "DEEMED_LOSE", "EXEMPTED_LOSE"):
+					outcome = "Defeat"
 				else:
-					foundany = True
-					if result["data"]["vsHistoryDetail"]["judgement"] == "WIN":
-						outcome = "Victory"
-					elif result["data"]["vsHistoryDetail"]["judgement"] in ("LOSE", "DEEMED_LOSE", "EXEMPTED_LOSE"):
-						outcome = "Defeat"
-					else:
-						outcome = "Draw"
-					splatfest_match = True if result["data"]["vsHistoryDetail"]["vsMode"]["mode"] == "FEST" else False
-					if splatfest_match: # keys will exist
-						our_team_name = result["data"]["vsHistoryDetail"]["myTeam"]["festTeamName"]
-						their_team_name = result["data"]["vsHistoryDetail"]["otherTeams"][0]["festTeamName"]
-						# works for tricolor too, since all teams would be the same
-						mirror_match = True if our_team_name == their_team_name else False
-					if outcome == "Victory":
-						battle_wins += 1
-						if splatfest_match and not mirror_match:
-							splatfest_wins += 1
-					elif outcome == "Defeat":
-						battle_losses += 1
-						if splatfest_match and not mirror_match:
-							splatfest_losses += 1
-					else:
-						battle_draws += 1
-						if splatfest_match and not mirror_match:
-							splatfest_draws += 1
-					if splatfest_match and mirror_match:
-						mirror_matches += 1
-
-					stagename = result["data"]["vsHistoryDetail"]["vsStage"]["name"]
-					shortname = stagename.split(" ")[-1]
-					if shortname == "d'Alfonsino": # lol franch
-						shortname = "Museum"
-					elif shortname == "Co.":
-						shortname = "Cargo"
-					endtime = utils.epoch_time(result["data"]["vsHistoryDetail"]["playedTime"]) + \
-						result["data"]["vsHistoryDetail"]["duration"]
-					dt = datetime.datetime.fromtimestamp(endtime).strftime('%I:%M:%S %p').lstrip("0")
-
-					print(f"New battle result detected at {dt}! ({shortname}, {outcome})")
-				cached_battles.append(num)
+					outcome = "Draw"
+				splatfest_match = True if result["data"]["vsHistoryDetail"]["vsMode"]["mode"] == "FEST" else False
+				if splatfest_match: # keys will exist
+					our_team_name = result["data"]["vsHistoryDetail"]["myTeam"]["festTeamName"]
+					their_team_name = result["data"]["vsHistoryDetail"]["otherTeams"][0]["festTeamName"]
+					# works for tricolor too, since all teams would be the same
+					mirror_match = True if our_team_name == their_team_name else False
+				if outcome == "Victory":
+					counters["battle_wins"] += 1
+					if splatfest_match and not mirror_match:
+						counters["splatfest_wins"] += 1
+				elif outcome == "Defeat":
+					counters["battle_losses"] += 1
+					if splatfest_match and not mirror_match:
+						counters["splatfest_losses"] += 1
+				else:
+					counters["battle_draws"] += 1
+					if splatfest_match and not mirror_match:
+						counters["splatfest_draws"] += 1
+				if splatfest_match and mirror_match:
+					counters["mirror_matches"] += 1
+
+				stagename = result["data"]["vsHistoryDetail"]["vsStage"]["name"]
+				shortname = stagename.split(" ")[-1]
+				if shortname == "d'Alfonsino": # lol franch
+					shortname = "Museum"
+				elif shortname == "Co.":
+					shortname = "Cargo"
+				endtime = utils.epoch_time(result["data"]["vsHistoryDetail"]["playedTime"]) + \
+					result["data"]["vsHistoryDetail"]["duration"]
+				dt = datetime.datetime.fromtimestamp(endtime).strftime('%I:%M:%S %p').lstrip("0")
+
+				print(f"New battle result detected at {dt}! ({shortname}, {outcome})" + (f" [{ACTIVE_ACCOUNT}]" if ACTIVE_ACCOUNT else ""))
+			cached_battles.add(num)
+			post_result(result, True, isblackout, istestrun) # True = is monitoring mode
+		else:
+			if result["data"]["coopHistoryDetail"]["jobPoint"] is None \
+			and utils.custom_key_exists("ignore_private_jobs", CONFIG_DATA): # works pre- and post-2.0.0
+				pass
+			else:
+				found["salmon"] = True
+				METRICS.inc("results_detected_total", account=account_label(), type="job")
+				outcome = "Clear" if result["data"]["coopHistoryDetail"]["resultWave"] == 0 else "Defeat"
+				if outcome == "Clear":
+					counters["job_successes"] += 1
+				else:
+					counters["job_failures"] += 1
+
+				stagename = result["data"]["coopHistoryDetail"]["coopStage"]["name"]
+				shortname = stagename.split(" ")[-1] # fine for salmon run stage names too
+				endtime = utils.epoch_time(result["data"]["coopHistoryDetail"]["playedTime"])
+
+				dt = datetime.datetime.fromtimestamp(endtime).strftime('%I:%M:%S %p').lstrip("0")
+				print(f"New job result detected at {dt}! ({shortname}, {outcome})" + (f" [{ACTIVE_ACCOUNT}]" if ACTIVE_ACCOUNT else ""))
 				post_result(result, True, isblackout, istestrun) # True = is monitoring mode
+			cached_jobs.add(num)
 
-	if which in ("both", "salmon"):
-		for num in reversed(salmon_results):
-			if num not in cached_jobs:
-				# get the full job data
-				result_post = requests.post(iksm.GRAPHQL_URL,
-					data=utils.gen_graphql_body(utils.translate_rid["CoopHistoryDetailQuery"], "coopHistoryDetailId", num),
-					headers=headbutt(forcelang='en-US'),
-					cookies=dict(_gtoken=GTOKEN))
-				result = json.loads(result_post.text)
-
-				if result["data"]["coopHistoryDetail"]["jobPoint"] is None \
-				and utils.custom_key_exists("ignore_private_jobs", CONFIG_DATA): # works pre- and post-2.0.0
-					pass
-				else:
-					foundany = True
-					outcome = "Clear" if result["data"]["coopHistoryDetail"]["resultWave"] == 0 else "Defeat"
-					if outcome == "Clear":
-						job_successes += 1
-					else:
-						job_failures += 1
+	for head in heads.values():
+		head.pop("missed", None)
+	cursors["heads"] = heads
+	if ink_results:
+		cursors["ink"] = {"id": ink_results[0], "time": utils.id_epoch_time(ink_results[0])}
+	if salmon_results:
+		cursors["salmon"] = {"id": salmon_results[0], "time": utils.id_epoch_time(salmon_results[0])}
 
-					stagename = result["data"]["coopHistoryDetail"]["coopStage"]["name"]
-					shortname = stagename.split(" ")[-1] # fine for salmon run stage names too
-					endtime = utils.epoch_time(result["data"]["coopHistoryDetail"]["playedTime"])
+	return found
 
-					dt = datetime.datetime.fromtimestamp(endtime).strftime('%I:%M:%S %p').lstrip("0")
-					print(f"New job result detected at {dt}! ({shortname}, {outcome})")
-					cached_jobs.append(num)
-					post_result(result, True, isblackout, istestrun) # True = is monitoring mode
 
-	return which, cached_battles, cached_jobs, battle_wins, battle_losses, battle_draws, splatfest_wins, splatfest_losses, splatfest_draws, mirror_matches, job_successes, job_failures, foundany
+def begin_monitoring(which, isblackout, istestrun, skipprefetch):
+	'''Resumes a saved -M session for the active account (uploading anything missed) or starts a new one.'''
 
+	checkpoint = read_checkpoint()
+	if checkpoint is not None and checkpoint.get("which") != which:
+		checkpoint = None # different kind of session - start fresh
 
-def monitor_battles(which, secs, isblackout, istestrun, skipprefetch):
-	'''Monitors SplatNet endpoint(s) for changes (new results) and uploads them (-M flag).'''
+	if checkpoint is not None:
+		saved_at = datetime.datetime.fromtimestamp(checkpoint["saved_at"]).strftime('%Y-%m-%d %I:%M:%S %p')
+		print(f"Resuming the monitoring session last saved at {saved_at}.")
+		cached_battles = utils.SeenIds.from_list(checkpoint["seen"]["ink"])
+		cached_jobs    = utils.SeenIds.from_list(checkpoint["seen"]["salmon"])
+		cursors        = checkpoint["cursors"]
+		counters       = dict(new_counters(), **checkpoint["counters"])
+
+		global TOKENS_VALIDATED_AT
+		TOKENS_VALIDATED_AT = max(TOKENS_VALIDATED_AT, checkpoint.get("tokens_validated_at") or 0)
+		if not skipprefetch and time.time() - TOKENS_VALIDATED_AT >= TOKEN_RECHECK_SECS:
+			prefetch_checks(printout=True)
+
+		# upload whatever showed up while we were down, then carry on as usual
+		print("Checking for results from while s3s wasn't running...", end='\r')
+		check_for_new_results(which, cached_battles, cached_jobs, counters, cursors, isblackout, istestrun)
+		write_checkpoint(which, cached_battles, cached_jobs, cursors, counters)
+	else:
+		if DEBUG:
+			print(f"* monitoring mode start - calling fetch_json() w/ which={which}")
+		# ! fetch from online - no 'specific' = should all be within 'latest'
+		cursors = {"heads": {}}
+		cached_battles, cached_jobs = fetch_json(which, separate=True, numbers_only=True, printout=True, skipprefetch=skipprefetch, heads=cursors["heads"])
+		if DEBUG:
+			print("* got battle numbers")
+
+		if cached_battles:
+			cursors["ink"] = {"id": cached_battles[0], "time": utils.id_epoch_time(cached_battles[0])}
+		if cached_jobs:
+			cursors["salmon"] = {"id": cached_jobs[0], "time": utils.id_epoch_time(cached_jobs[0])}
+
+		# oldest first, so the oldest get evicted first
+		cached_battles = utils.SeenIds(reversed(cached_battles))
+		cached_jobs    = utils.SeenIds(reversed(cached_jobs))
+
+		counters = new_counters()
+		write_checkpoint(which, cached_battles, cached_jobs, cursors, counters)
+
+	return {"battles": cached_battles, "jobs": cached_jobs, "cursors": cursors, "counters": counters}
 
-	if DEBUG:
-		print(f"* monitoring mode start - calling fetch_json() w/ which={which}")
-	# ! fetch from online - no 'specific' = should all be within 'latest'
-	cached_battles, cached_jobs = fetch_json(which, separate=True, numbers_only=True, printout=True, skipprefetch=skipprefetch)
-	if DEBUG:
-		print("* got battle numbers")
 
-	cached_battles.reverse()
-	cached_jobs.reverse()
+def monitor_battles(which, secs, isblackout, istestrun, skipprefetch, accounts=None, daemon_port=None):
+	'''Monitors SplatNet endpoint(s) for changes (new results) and uploads them (-M flag).'''
 
-	# counters
-	battle_wins, battle_losses, battle_draws = [0]*3 # init all to 0
-	splatfest_wins, splatfest_losses, splatfest_draws, mirror_matches = [0]*4
-	job_successes, job_failures = [0]*2
+	# one process for any number of accounts (--accounts flag) - each keeps its own tokens, seen IDs & counters,
+	# while the HTTP session, thread pool and caches are shared
+	accounts = accounts or [None] # None = the top-level account in config.txt
+	multi = len(accounts) > 1
+	sessions = {}
+	for account in accounts:
+		use_account(account)
+		if multi:
+			print(f"== {account} ==")
+		sessions[account] = begin_monitoring(which, isblackout, istestrun, skipprefetch)
+
+	# each account's streams get their own adaptive schedule - see utils.PollSchedule
+	schedules = {}
+	for account in accounts:
+		if which in ("both", "ink"):
+			schedules[(account, "ink")] = utils.PollSchedule(secs)
+		if which in ("both", "salmon"):
+			schedules[(account, "salmon")] = utils.PollSchedule(max(secs, SALMON_MIN_SECS) if which == "both" else secs)
+	for (account, stream), schedule in schedules.items(): # spread accounts out across the interval
+		schedule.next_due += secs * accounts.index(account) / len(accounts)
+
+	start_outbox_drainer() # uploads that failed while monitoring get retried in the background
 
 	mins = str(round(float(secs)/60.0, 2))
 	mins = mins[:-2] if mins[-2:] == ".0" else mins
-	print(f"Waiting for new {utils.set_noun(which)}... (checking every {mins} minute{'s' if mins != '1' else ''})")
+	print(f"Waiting for new {utils.set_noun(which)}" + (f" on {len(accounts)} accounts" if multi else "") + \
+		f"... (checking every {mins} minute{'s' if mins != '1' else ''}, less often while idle)")
+
+	server = None
+	if daemon_port is not None: # daemon mode - see control.py
+		try:
+			server = control.ControlServer(daemon_port, METRICS, lambda: monitoring_status(which, sessions, schedules))
+		except OSError as e:
+			print(f"Could not start the control server on port {daemon_port}: {e}. Exiting.")
+			sys.exit(1)
+		server.start()
+		signal.signal(signal.SIGTERM, stop_on_signal) # e.g. from systemd - shut down like Ctrl+C
+		print(f"Control server listening on http://127.0.0.1:{daemon_port}/ (GET /metrics, /status; POST /backfill, /export, /shutdown)")
 
 	try:
 		while True:
-			for i in range(secs, -1, -1):
-				sys.stdout.write(f"Press Ctrl+C to exit. {i} ")
-				sys.stdout.flush()
-				time.sleep(1)
-				sys.stdout.write("\r")
-
-			print("Checking for new results...", end='\r')
-			input_params = [
-				which,
-				cached_battles, cached_jobs,
-				battle_wins, battle_losses, battle_draws,
-				splatfest_wins, splatfest_losses, splatfest_draws, mirror_matches,
-				job_successes, job_failures,
-				isblackout, istestrun
-			]
-			which, cached_battles, cached_jobs, battle_wins, battle_losses, battle_draws, splatfest_wins, splatfest_losses, splatfest_draws, mirror_matches, job_successes, job_failures, foundany=check_for_new_results(*input_params)
+			next_due = min(schedule.next_due for schedule in schedules.values())
+			if server is None:
+				wait_until(next_due)
+			else:
+				command = server.next_command(next_due - time.time())
+				if command is not None:
+					run_command(command, which, accounts, isblackout, istestrun)
+					continue
+
+			# the most overdue account goes next, checking all of its streams that are due
+			now = time.time()
+			account = min(schedules, key=lambda key: schedules[key].next_due)[0]
+			due = [stream for (acct, stream), schedule in schedules.items() if acct == account and schedule.next_due <= now] \
+				or [min((key for key in schedules if key[0] == account), key=lambda key: schedules[key].next_due)[1]]
+
+			use_account(account)
+			session = sessions[account]
+			print("Checking for new results" + (f" ({account})" if multi else "") + "...", end='\r')
+			found = check_for_new_results("both" if len(due) == 2 else due[0],
+				session["battles"], session["jobs"], session["counters"], session["cursors"], isblackout, istestrun)
+			write_checkpoint(which, session["battles"], session["jobs"], session["cursors"], session["counters"])
+			for stream in due:
+				schedules[(account, stream)].record(found[stream])
+			METRICS.set("last_check_timestamp_seconds", int(now), account=account_label())
 
 	except KeyboardInterrupt:
 		print(f"\n\nChecking to see if there are unuploaded {utils.set_noun(which)} before exiting...")
 
-		input_params = [
-			which,
-			cached_battles, cached_jobs,
-			battle_wins, battle_losses, battle_draws,
-			splatfest_wins, splatfest_losses, splatfest_draws, mirror_matches,
-			job_successes, job_failures,
-			isblackout, istestrun
-		]
-		which, cached_battles, cached_jobs, battle_wins, battle_losses, battle_draws, splatfest_wins, splatfest_losses, splatfest_draws, mirror_matches, job_successes, job_failures, foundany=check_for_new_results(*input_params)
+		for account in accounts:
+			use_account(account)
+			session = sessions[account]
+			if multi:
+				print(f"\n== {account} ==")
+			found = check_for_new_results(which, session["battles"], session["jobs"], session["counters"], session["cursors"],
+				isblackout, istestrun)
+
+			noun = utils.set_noun(which)
+			if any(found.values()):
+				print(f"Successfully uploaded remaining {noun}.")
+			else:
+				print(f"No remaining {noun} found.")
+
+			print_session_report(which, session["counters"])
+			# always kept, so a restart (deploy, crash, reboot) still catches up on what was played in between.
+			# a signal means s3s is being restarted under a supervisor - carry on with the same session counts
+			counters = session["counters"] if STOP_SIGNAL is not None else new_counters()
+			write_checkpoint(which, session["battles"], session["jobs"], session["cursors"], counters)
+		if server is not None:
+			server.stop()
+		print("Bye!")
 
-		noun = utils.set_noun(which)
-		if foundany:
-			print(f"Successfully uploaded remaining {noun}.")
-		else:
-			print(f"No remaining {noun} found.")
 
-		print("\n== SESSION REPORT ==")
-		if which in ("ink", "both"):
-			if battle_draws == 0:
-				print(f"Battles: {battle_wins} win{'' if battle_wins == 1 else 's'} and " \
-					f"{battle_losses} loss{'' if battle_losses == 1 else 'es'}.")
-			else:
-				print(f"Battles: {battle_wins} win{'' if battle_wins == 1 else 's'}, " \
-					f"{battle_losses} loss{'' if battle_losses == 1 else 'es'}, and " \
-					f"{battle_draws} draw{'' if battle_draws == 1 else 's'}.")
-
-			if splatfest_wins + splatfest_losses + splatfest_draws > 0:
-				if splatfest_draws == 0:
-					print(f"Splatfest: {splatfest_wins} win{'' if splatfest_wins == 1 else 's'} and " \
-						f"{splatfest_losses} loss{'' if splatfest_losses == 1 else 'es'} against the other Splatfest teams.")
-				else:
-					print(f"Splatfest: {splatfest_wins} win{'' if splatfest_wins == 1 else 's'}, " \
-						f"{splatfest_losses} loss{'' if splatfest_losses == 1 else 'es'}, and " \
-						f"{splatfest_draws} draw{'' if splatfest_draws == 1 else 's'} against the other Splatfest teams.")
+def stop_on_signal(signum, frame):
+	'''Signal handler that stops monitoring gracefully, as if Ctrl+C had been pressed.'''
 
-				print(f"{mirror_matches} mirror match{'' if mirror_matches == 1 else 'es'} against your Splatfest team.")
+	global STOP_SIGNAL
+	STOP_SIGNAL = signum
+	raise KeyboardInterrupt
 
-		if which in ("salmon", "both"):
-			print(f"Salmon Run: {job_successes} success{'' if job_successes == 1 else 'es'} and " \
-				f"{job_failures} failure{'' if job_failures == 1 else 's'}.")
 
-		print("Bye!")
+def run_command(command, which, accounts, isblackout, istestrun):
+	'''Runs a command queued through daemon mode's control server, for every monitored account.'''
+
+	if command == "shutdown":
+		raise KeyboardInterrupt
+
+	print(f"\nRunning queued command: {command}")
+	for account in accounts:
+		use_account(account)
+		skipprefetch = time.time() - TOKENS_VALIDATED_AT < TOKEN_RECHECK_SECS
+		outcome = "ok"
+		try:
+			if command == "backfill": # -r
+				if not skipprefetch:
+					prefetch_checks()
+				check_if_missing(which, isblackout, istestrun, True)
+			elif command == "export": # -o
+				export_results(skipprefetch, None if account is None else os.path.join(os.getcwd(), account))
+		except SystemExit: # the usual "print & exit" on errors shouldn't take the daemon down
+			outcome = "failed"
+			print(f"(!) {command} failed" + (f" for account {account}" if account else "") + ".")
+		except Exception as e: # nor should a network error or anything else unexpected
+			outcome = "failed"
+			print(f"(!) {command} failed" + (f" for account {account}" if account else "") + f": {e!r}")
+		METRICS.inc("commands_total", command=command, account=account_label(), outcome=outcome)
+
+
+def monitoring_status(which, sessions, schedules):
+	'''Returns a JSON-safe snapshot of the monitoring state, for daemon mode's /status endpoint.'''
+
+	accounts = {}
+	for account, session in list(sessions.items()):
+		accounts[account or "default"] = {
+			"seen_ids":   {"ink": len(session["battles"]), "salmon": len(session["jobs"])},
+			"cursors":    {stream: cursor for stream, cursor in session["cursors"].items() if stream != "heads"},
+			"counters":   dict(session["counters"]),
+			"next_check": {stream: int(schedule.next_due) for (acct, stream), schedule in list(schedules.items()) if acct == account},
+			"interval":   {stream: round(schedule.interval) for (acct, stream), schedule in list(schedules.items()) if acct == account}
+		}
+	with transfer_lock:
+		transfer = dict(TRANSFER_STATS)
+		compress = UPLOAD_COMPRESSION
+
+	return {
+		"version":            A_VERSION,
+		"which":              which,
+		"active_account":     account_label(),
+		"accounts":           accounts,
+		"transfer":           transfer,
+		"queue_waits":        {name: {"requests": count, "total_secs": round(total, 3), "max_secs": round(longest, 3)}
+			for name, (count, total, longest) in queue_wait_report().items()},
+		"upload_compression": compress,
+		"outbox":             {"waiting": len(OUTBOX), "rejected": len(OUTBOX.pending(failed=True))}
+	}
+
+
+def wait_until(due_time):
+	'''Sleeps until the given epoch time, showing a countdown on a terminal and waking up only once otherwise.'''
+
+	if not sys.stdout.isatty(): # headless (e.g. running as a service) - no per-second wakeups
+		time.sleep(max(0, due_time - time.time()))
+		return
+
+	while True:
+		remaining = due_time - time.time()
+		if remaining <= 0:
+			break
+		sys.stdout.write(f"Press Ctrl+C to exit. {int(remaining)} ")
+		sys.stdout.flush()
+		time.sleep(min(1, remaining))
+		sys.stdout.write("\r")
+
+
+def print_session_report(which, counters):
+	'''Prints the win/loss tallies for a monitoring session.'''
+
+	battle_wins, battle_losses, battle_draws = counters["battle_wins"], counters["battle_losses"], counters["battle_draws"]
+	splatfest_wins, splatfest_losses = counters["splatfest_wins"], counters["splatfest_losses"]
+	splatfest_draws, mirror_matches  = counters["splatfest_draws"], counters["mirror_matches"]
+	job_successes, job_failures      = counters["job_successes"], counters["job_failures"]
+
+	print("\n== SESSION REPORT ==")
+	if which in ("ink", "both"):
+		if battle_draws == 0:
+			print(f"Battles: {battle_wins} win{'' if battle_wins == 1 else 's'} and " \
+				f"{battle_losses} loss{'' if battle_losses == 1 else 'es'}.")
+		else:
+			print(f"Battles: {battle_wins} win{'' if battle_wins == 1 else 's'}, " \
+				f"{battle_losses} loss{'' if battle_losses == 1 else 'es'}, and " \
+				f"{battle_draws} draw{'' if battle_draws == 1 else 's'}.")
+
+		if splatfest_wins + splatfest_losses + splatfest_draws > 0:
+			if splatfest_draws == 0:
+				print(f"Splatfest: {splatfest_wins} win{'' if splatfest_wins == 1 else 's'} and " \
+					f"{splatfest_losses} loss{'' if splatfest_losses == 1 else 'es'} against the other Splatfest teams.")
+			else:
+				print(f"Splatfest: {splatfest_wins} win{'' if splatfest_wins == 1 else 's'}, " \
+					f"{splatfest_losses} loss{'' if splatfest_losses == 1 else 'es'}, and " \
+					f"{splatfest_draws} draw{'' if splatfest_draws == 1 else 's'} against the other Splatfest teams.")
+
+			print(f"{mirror_matches} mirror match{'' if mirror_matches == 1 else 'es'} against your Splatfest team.")
+
+	if which in ("salmon", "both"):
+		print(f"Salmon Run: {job_successes} success{'' if job_successes == 1 else 'es'} and " \
+			f"{job_failures} failure{'' if job_failures == 1 else 's'}.")
 
 
 class SquidProgress:
@@ -1728,12 +2407,10 @@ def export_seed_json(skipprefetch=False):
 		prefetch_checks(printout=True)
 
 	sha = utils.translate_rid["MyOutfitCommonDataEquipmentsQuery"]
-	outfit_post = requests.post(iksm.GRAPHQL_URL, data=utils.gen_graphql_body(sha),
-		headers=headbutt(), cookies=dict(_gtoken=GTOKEN))
+	outfit_post = graphql_post(utils.gen_graphql_body(sha), PRIORITY_HOUSEKEEPING)
 
 	sha = utils.translate_rid["LatestBattleHistoriesQuery"]
-	history_post = requests.post(iksm.GRAPHQL_URL, data=utils.gen_graphql_body(sha),
-		headers=headbutt(), cookies=dict(_gtoken=GTOKEN))
+	history_post = graphql_post(utils.gen_graphql_body(sha), PRIORITY_HOUSEKEEPING)
 
 	if outfit_post.status_code != 200 or history_post.status_code != 200:
 		print("Could not reach SplatNet 3. Exiting.")
@@ -1753,8 +2430,7 @@ def export_seed_json(skipprefetch=False):
 	except KeyError: # no recent battles (mr. grizz is pleased)
 		try:
 			sha = utils.translate_rid["CoopHistoryQuery"]
-			history_post = requests.post(iksm.GRAPHQL_URL, data=utils.gen_graphql_body(sha),
-				headers=headbutt(), cookies=dict(_gtoken=GTOKEN))
+			history_post = graphql_post(utils.gen_graphql_body(sha), PRIORITY_HOUSEKEEPING)
 
 			if history_post.status_code != 200:
 				print("Could not reach SplatNet 3. Exiting.")
@@ -1782,6 +2458,249 @@ def export_seed_json(skipprefetch=False):
 	print(f"gear_{t}.json has been exported.")
 
 
+def export_results(skipprefetch=False, base_dir=None, db_path=None):
+	'''Exports all possible results to local files (-o flag), in the current directory unless given another.'''
+
+	if not skipprefetch:
+		prefetch_checks(printout=True)
+	if db_path is not None: # --db
+		export_to_db(db_path)
+		return
+	cwd = os.getcwd() if base_dir is None else base_dir
+	if utils.custom_key_exists("old_export_format", CONFIG_DATA):
+		export_dir = os.path.join(cwd, f'export-{int(time.time())}')
+		overview_filename = "overview.json"
+	else:
+		export_dir = os.path.join(cwd, 'exports')
+		utc_time = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None).strftime('%Y%m%dT%H%M%SZ')
+		overview_filename = f'overview-{utc_time}.json'
+	if not os.path.exists(export_dir):
+		os.makedirs(export_dir)
+
+	# only fetch details for results that aren't exported yet - matched by ID, not filename
+	# each result is handed to a writer as soon as it's fetched, so writing overlaps with fetching the rest
+	old_format = utils.custom_key_exists("old_export_format", CONFIG_DATA)
+	writers, indexes = {}, {}
+	if not old_format:
+		fmt = CONFIG_DATA.get("export_format", "json")
+		if fmt not in archive.EXPORT_FORMATS:
+			print(f"(!) Unknown export_format '{fmt}' in config.txt. Using json.")
+			fmt = "json"
+		elif fmt.endswith(".zst") and not archive.zstd_available():
+			print(f"(!) export_format '{fmt}' requires the zstandard module (pip install zstandard). Using json.gz.")
+			fmt = "json.gz"
+		for folder, detail_key in (("results", "vsHistoryDetail"), ("coop_results", "coopHistoryDetail")):
+			indexes[detail_key] = archive.index_export_dir(os.path.join(export_dir, folder), detail_key)
+			writers[detail_key] = archive.ExportWriter(os.path.join(export_dir, folder), fmt)
+
+	def write_result(result):
+		detail_key = "vsHistoryDetail" if "vsHistoryDetail" in result["data"] else "coopHistoryDetail"
+		detail = result["data"][detail_key]
+		if detail is not None:
+			filename = writers[detail_key].write(detail["playedTime"].replace("-", "").replace(":", ""), result)
+			indexes[detail_key][utils.compact_id(detail["id"])] = filename
+
+	print("Fetching your JSON files to export locally. This might take a while...")
+	# ! fetch from online - fetch_json() calls prefetch_checks() to gen or check tokens
+	parents, results, coop_results = fetch_json("both", separate=True, exportall=True, specific=True, skipprefetch=True,
+		skip_ids=set(indexes.get("vsHistoryDetail", {})) | set(indexes.get("coopHistoryDetail", {})),
+		on_result=None if old_format else write_result)
+
+	for folder, detail_key in (("results", "vsHistoryDetail"), ("coop_results", "coopHistoryDetail")):
+		if detail_key in writers:
+			writers[detail_key].close()
+			archive.save_export_index(os.path.join(export_dir, folder), indexes[detail_key])
+
+	print()
+	if parents is not None:
+		if old_format or utils.custom_key_exists("overview_chunks", CONFIG_DATA, value=False):
+			with open(os.path.join(cwd, export_dir, overview_filename), "x") as fout:
+				json.dump(list(parents), fout)
+		else: # history groups that haven't changed since the last export are stored only once
+			new_chunks = archive.write_overview(os.path.join(export_dir, overview_filename), parents,
+				os.path.join(export_dir, 'overview_chunks'))
+			if DEBUG:
+				print(f"* {new_chunks} new overview chunk{'' if new_chunks == 1 else 's'}")
+		print(f'Created {overview_filename} with general info about battle/job stats.')
+
+	if results is not None:
+		if old_format:
+			with open(os.path.join(cwd, export_dir, "results.json"), "x") as fout:
+				utils.dump_json_list(results, fout) # written as it's merged
+				print("Created results.json with recent battles (up to 50 per type).")
+		else:
+			print(f"Updated results directory with recent battles (up to 50 per type; {len(results)} new).")
+
+	if coop_results is not None:
+		if old_format:
+			with open(os.path.join(cwd, export_dir, "coop_results.json"), "x") as fout:
+				utils.dump_json_list(coop_results, fout)
+				print("Created coop_results.json with recent Salmon Run jobs (up to 50).")
+		else:
+			print(f"Updated coop_results directory with recent Salmon Run jobs (up to 50; {len(coop_results)} new).")
+
+	if parents is not None:
+		parents.close() # also deletes what the results spilled to disk
+
+
+def export_to_db(db_path):
+	'''Exports all possible results into an SQLite result store (-o with --db) instead of files.'''
+
+	db = resultdb.ResultDB(db_path)
+	print("Fetching your JSON files to export locally. This might take a while...")
+	parents, results, coop_results = fetch_json("both", separate=True, exportall=True, specific=True, skipprefetch=True,
+		skip_ids=set(utils.compact_id(result_id) for result_id in db.ids()), on_result=db.add_result)
+	print()
+	if parents is not None:
+		db.add_overview(list(parents))
+		parents.close()
+	print(f"Updated {db_path} with {len(results or [])} new battle{'' if len(results or []) == 1 else 's'} " \
+		f"and {len(coop_results or [])} new job{'' if len(coop_results or []) == 1 else 's'}.")
+	db.close()
+
+
+def statink_uuid_list():
+	'''Returns the set of uuids of every battle & job already on stat.ink (for -i).'''
+
+	auth = {'Authorization': f'Bearer {API_KEY}'}
+	resp_b = SESSION.get("https://stat.ink/api/v3/s3s/uuid-list?lobby=adaptive", headers=auth)
+	resp_j = SESSION.get("https://stat.ink/api/v3/salmon/uuid-list", headers=auth)
+	try:
+		statink_uploads = set(json.loads(resp_b.text))
+		statink_uploads.update(json.loads(resp_j.text))
+	except:
+		print(f"Encountered an error while checking recently-uploaded data. Is stat.ink down?")
+		sys.exit(1)
+	return statink_uploads
+
+
+def statink_uuids(result):
+	'''Returns a battle or job's (old, new) stat.ink uuids - see prepare_battle_result() - or None if it's empty.'''
+
+	if result["data"].get("vsHistoryDetail") is not None: # ink battle
+		full_id = utils.b64d(result["data"]["vsHistoryDetail"]["id"])
+		# old one's not unique because nintendo hates us
+		return full_id[-36:], str(uuid.uuid5(utils.S3S_NAMESPACE, full_id[-52:]))
+	if result["data"].get("coopHistoryDetail") is not None: # salmon run job
+		full_id = utils.b64d(result["data"]["coopHistoryDetail"]["id"])
+		return str(uuid.uuid5(utils.SALMON_NAMESPACE, full_id[-52:])), str(uuid.uuid5(utils.SALMON_NAMESPACE, full_id))
+	return None
+
+
+def on_statink(result, statink_uploads, printout=True):
+	'''Checks whether a result is already on stat.ink under either uuid (the old one only counts without force_uploads).'''
+
+	old_uuid, new_uuid = statink_uuids(result)
+	noun = "battle" if result["data"].get("vsHistoryDetail") is not None else "job"
+	if new_uuid in statink_uploads:
+		if printout:
+			print(f"Skipping already-uploaded {noun}.")
+		return True
+	if old_uuid in statink_uploads and not utils.custom_key_exists("force_uploads", CONFIG_DATA):
+		if printout:
+			print(f"Skipping already-uploaded {noun} (use the `force_uploads` config key to override).")
+		return True
+	return False
+
+
+def not_on_statink(results, statink_uploads, sent=None):
+	'''Yields the results that aren't on stat.ink yet (each one once), adding their uuids to `sent` as they go out.'''
+
+	sent = set() if sent is None else sent
+	for result in results:
+		uuids = statink_uuids(result)
+		if uuids is None or uuids[1] in sent or on_statink(result, statink_uploads):
+			continue
+		sent.add(uuids[1])
+		yield result
+
+
+def watch_folder(folder, overview_path, overview_data, isblackout, istestrun):
+	'''Uploads results as they're written into a folder (-i with --watch), until stopped.'''
+
+	watcher = watch.FolderWatcher(folder)
+	journal = watch.Journal(folder)
+	statink_uploads, checked_at = statink_uuid_list(), time.time()
+	overview_mtime = os.stat(overview_path).st_mtime_ns
+	names = set(os.listdir(folder)) # catch up on anything written while we weren't watching
+
+	signal.signal(signal.SIGTERM, stop_on_signal)
+	print(f"Watching {folder} for new results ({watcher.mode}). Press Ctrl+C to stop.")
+	try:
+		while True:
+			names |= watcher.changes(WATCH_IDLE_SECS)
+			if not names:
+				continue
+			while True: # a tool dropping many files at once gets one batch, not one upload run per file
+				more = watcher.changes(WATCH_SETTLE_SECS)
+				if not more:
+					break
+				names |= more
+
+			results = []
+			for name in sorted(names):
+				if archive.is_result_file(name):
+					results.extend(watch.read_new_results(folder, name, journal))
+			names = set()
+			if not results:
+				journal.save()
+				continue
+
+			if time.time() - checked_at > WATCH_REFRESH_SECS: # also picks up uploads from elsewhere
+				statink_uploads, checked_at = statink_uuid_list(), time.time()
+			if os.stat(overview_path).st_mtime_ns != overview_mtime:
+				overview_mtime = os.stat(overview_path).st_mtime_ns
+				overview_data = archive.read_overview(overview_path)
+
+			print(f"\n{len(results)} new result{'' if len(results) == 1 else 's'} in {folder}.")
+			for detail_key in ("vsHistoryDetail", "coopHistoryDetail"): # kept apart - jobs are compared to the previous one
+				batch = sorted((result for result in results if result["data"].get(detail_key)),
+					key=lambda result: result["data"][detail_key]["playedTime"])
+				accepted = set(post_result(not_on_statink(batch, statink_uploads), False, isblackout, istestrun,
+					overview_data=overview_data))
+				statink_uploads.update(statink_uuids(result)[1] for result in batch
+					if result["data"][detail_key]["id"] in accepted)
+			# only once they're uploaded (or safely in the outbox) - if we're stopped before this, the next run reads
+			# these files again and skips whatever made it to stat.ink
+			journal.save()
+	except KeyboardInterrupt:
+		print("\nStopped watching.")
+	finally:
+		watcher.close()
+
+
+def import_from_db(db_path, which, filters, isblackout, istestrun):
+	'''Uploads results from an SQLite result store (-i with a --db file) that match the filters & aren't on stat.ink yet.'''
+
+	db = resultdb.ResultDB(db_path)
+	auth = {'Authorization': f'Bearer {API_KEY}'}
+	try:
+		statink_uploads = set()
+		if which in ("ink", "both"):
+			statink_uploads.update(SESSION.get("https://stat.ink/api/v3/s3s/uuid-list?lobby=adaptive", headers=auth).json())
+		if which in ("salmon", "both"):
+			statink_uploads.update(SESSION.get("https://stat.ink/api/v3/salmon/uuid-list", headers=auth).json())
+	except ValueError:
+		print(f"Encountered an error while checking recently-uploaded data. Is stat.ink down?")
+		sys.exit(1)
+	# so "not on stat.ink yet" is just part of the query - same uuid rules as every other -i
+	db.mark_uploaded([statink_uuids(result)[1] for result in db.query(pending_only=True)
+		if on_statink(result, statink_uploads, printout=False)])
+
+	overview_file = db.latest_overview()
+	for kind, noun in (("battle", "battle"), ("job", "job")):
+		if (kind == "battle" and which == "salmon") or (kind == "job" and which == "ink"):
+			continue
+		if db.count(kind=kind, pending_only=True, **filters) == 0:
+			print(f"No matching {noun}s to upload that aren't already on stat.ink.")
+			continue
+		# already oldest first, so it's streamed straight through (post_result() only sorts lists)
+		to_upload = db.query(kind=kind, pending_only=True, **filters)
+		accepted = post_result(to_upload, False, isblackout, istestrun, overview_data=overview_file)
+		db.mark_uploaded(resultdb.result_uuid(kind, result_id) for result_id in accepted)
+	db.close()
+
+
 def parse_arguments():
 	'''Setup for command-line options.'''
 
@@ -1801,12 +2720,34 @@ def parse_arguments():
 		help="remove player names from uploaded scoreboard data")
 	parser.add_argument("-o", required=False, action="store_true",
 		help="export all possible results to local files")
-	parser.add_argument("-i", dest="path", nargs=2, required=False,
-		help="upload local results: `-i (coop_)results/ overview.json`")
+	parser.add_argument("-i", dest="path", nargs="+", required=False,
+		help="upload local results: `-i (coop_)results/ overview.json`, or `-i s3s.db` (see --db)")
 	parser.add_argument("-t", required=False, action="store_true",
 		help="dry run for testing (won't post to stat.ink)")
 	parser.add_argument("--getseed", required=False, action="store_true",
 		help="export JSON for gear & Shell-Out Machine seed checker")
+	parser.add_argument("--accounts", dest="accounts", required=False, nargs="?", action="store", const="",
+		help="with -M, monitor several accounts from config.txt (comma-separated names; default: all)")
+	parser.add_argument("--daemon", dest="PORT", required=False, nargs="?", action="store", const=9142,
+		help="with -M, run as a service with a local control API & metrics on PORT (default: 9142)")
+	parser.add_argument("--sync", required=False, action="store_true",
+		help="upload only results new since the last --sync run (for scheduled runs; -r forces a full check)")
+	parser.add_argument("--outbox", dest="outbox", required=False, nargs="?", action="store", const="list",
+		choices=["list", "flush"], help="show uploads waiting to be retried, or `--outbox flush` to retry them now")
+	parser.add_argument("--compact", dest="compact_dir", required=False, action="store",
+		help="pack an exported results/ or coop_results/ folder into an indexed segment archive")
+	parser.add_argument("--stats", dest="stats_path", required=False, action="store",
+		help="show stats for an -o export folder or --db result store (requires numpy)")
+	parser.add_argument("--watch", required=False, action="store_true",
+		help="with -i, keep uploading new results as they're written into the folder")
+	parser.add_argument("--db", dest="db_path", required=False, action="store",
+		help="with -o, export into an SQLite result store at DB_PATH instead of files")
+	parser.add_argument("--since", dest="since", required=False, action="store",
+		help="with `-i s3s.db`, only upload results played on or after this date (YYYY-MM-DD)")
+	parser.add_argument("--mode", dest="mode", required=False, action="store",
+		help="with `-i s3s.db`, only upload results from this mode (e.g. BANKARA, X_MATCH, BIG_RUN)")
+	parser.add_argument("--rule", dest="rule", required=False, action="store",
+		help="with `-i s3s.db`, only upload battles with this rule (e.g. AREA, LOFT, GOAL, CLAM)")
 	parser.add_argument("--norefresh", dest="RC", required=False, nargs="?", action="store", help=argparse.SUPPRESS, const=0)
 	parser.add_argument("--skipprefetch", required=False, action="store_true", help=argparse.SUPPRESS)
 	return parser.parse_args()
@@ -1828,6 +2769,21 @@ def main():
 	only_salmon = parser_result.osr # salmon run ONLY
 	blackout    = parser_result.blackout
 	getseed     = parser_result.getseed
+	accounts    = parser_result.accounts # multi-account monitoring
+	daemon_port = parser_result.PORT     # daemon mode
+	sync        = parser_result.sync     # incremental mode for scheduled runs
+	outbox_cmd  = parser_result.outbox   # inspect/flush queued uploads
+	compact_dir = parser_result.compact_dir # pack an export folder into segments
+	db_path     = parser_result.db_path  # SQLite result store
+	stats_path  = parser_result.stats_path # local analytics
+	watch_mode  = parser_result.watch    # continuous -i
+	db_filters  = {"mode": parser_result.mode, "rule": parser_result.rule}
+	if parser_result.since is not None:
+		try:
+			db_filters["since"] = utils.epoch_time(f"{parser_result.since}T00:00:00Z")
+		except ValueError:
+			print("Date for --since must be in YYYY-MM-DD format. Exiting.")
+			sys.exit(1)
 
 	# testing/dev stuff
 	test_run     = parser_result.t            # send to stat.ink as dry run
@@ -1839,8 +2795,9 @@ def main():
 
 	# setup
 	#######
+	atexit.register(print_transfer_report)
 	check_for_updates()
-	if not getseed:
+	if not getseed and accounts is None: # each account profile has its own key
 		check_statink_key()
 	set_language()
 
@@ -1874,6 +2831,25 @@ def main():
 		print("Cannot use -o with other arguments. Exiting.")
 		sys.exit(0)
 
+	elif accounts is not None and n_value is None:
+		print("--accounts can only be used with monitoring mode (-M). Exiting.")
+		sys.exit(0)
+
+	elif sync and (n_value is not None or accounts is not None):
+		print("Cannot use --sync with -M or --accounts. Exiting.")
+		sys.exit(0)
+
+	elif daemon_port is not None and n_value is None:
+		print("--daemon can only be used with monitoring mode (-M). Exiting.")
+		sys.exit(0)
+
+	if daemon_port is not None:
+		try:
+			daemon_port = int(daemon_port)
+		except ValueError:
+			print("Port provided for --daemon must be an integer. Exiting.")
+			sys.exit(1)
+
 	secs = -1
 	if n_value is not None:
 		try:
@@ -1888,74 +2864,55 @@ def main():
 			print("Minimum number of seconds in monitoring mode is 60. Exiting.")
 			sys.exit(0)
 
+	# queued uploads: --outbox flag
+	################################
+	if outbox_cmd is not None:
+		manage_outbox(outbox_cmd)
+		sys.exit(0)
+	elif stats_path is not None:
+		if not stats.numpy_available():
+			print("--stats requires the numpy module (pip install numpy). Exiting.")
+			sys.exit(1)
+		if not os.path.exists(stats_path):
+			print(f"{stats_path} does not exist!")
+			sys.exit(1)
+		cache = stats.load_archive(stats_path)
+		if DEBUG:
+			print(f"* {cache.added} new result{'' if cache.added == 1 else 's'} added to the stats cache")
+		stats.print_report(cache)
+		sys.exit(0)
+	elif compact_dir is not None:
+		if not os.path.isdir(compact_dir):
+			print(f"Directory {compact_dir} does not exist!")
+			sys.exit(1)
+		print("Packing results into segments...")
+		files_packed, results_added = archive.compact_export_dir(compact_dir)
+		print(f"Packed {results_added} result{'s' if results_added != 1 else ''} from {files_packed} " \
+			f"file{'s' if files_packed != 1 else ''} into {os.path.join(compact_dir, archive.SEGMENT_INDEX)}.")
+		sys.exit(0)
+	elif not outfile and len(OUTBOX) > 0:
+		drain_outbox(printout=True) # retry anything due from an earlier run before uploading more
+
 	# export results to file: -o flag
 	#################################
 	if outfile:
-		if not skipprefetch:
-			prefetch_checks(printout=True)
-		print("Fetching your JSON files to export locally. This might take a while...")
-		# ! fetch from online - fetch_json() calls prefetch_checks() to gen or check tokens
-		parents, results, coop_results = fetch_json("both", separate=True, exportall=True, specific=True, skipprefetch=True)
-
-		cwd = os.getcwd()
-		if utils.custom_key_exists("old_export_format", CONFIG_DATA):
-			export_dir = os.path.join(cwd, f'export-{int(time.time())}')
-			overview_filename = "overview.json"
-		else:
-			export_dir = os.path.join(cwd, 'exports')
-			utc_time = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None).strftime('%Y%m%dT%H%M%SZ')
-			overview_filename = f'overview-{utc_time}.json'
-		if not os.path.exists(export_dir):
-			os.makedirs(export_dir)
-
-		print()
-		if parents is not None:
-			with open(os.path.join(cwd, export_dir, overview_filename), "x") as fout:
-				json.dump(parents, fout)
-				print(f'Created {overview_filename} with general info about battle/job stats.')
-
-		if results is not None:
-			if utils.custom_key_exists("old_export_format", CONFIG_DATA):
-				with open(os.path.join(cwd, export_dir, "results.json"), "x") as fout:
-					json.dump(results, fout)
-					print("Created results.json with recent battles (up to 50 per type).")
-			else:
-				results_dir = os.path.join(export_dir, 'results')
-				if not os.path.exists(results_dir):
-					os.makedirs(results_dir)
-
-				for result in results:
-					filename = result["data"]["vsHistoryDetail"]["playedTime"].replace("-", "").replace(":", "") + ".json"
-					out_path = os.path.join(results_dir, filename)
-					if not os.path.exists(out_path):
-						with open(out_path, "x") as fout:
-							json.dump(result, fout)
-				print("Updated results directory with recent battles (up to 50 per type).")
-
-		if coop_results is not None:
-			if utils.custom_key_exists("old_export_format", CONFIG_DATA):
-				with open(os.path.join(cwd, export_dir, "coop_results.json"), "x") as fout:
-					json.dump(coop_results, fout)
-					print("Created coop_results.json with recent Salmon Run jobs (up to 50).")
-			else:
-				coop_results_dir = os.path.join(export_dir, 'coop_results')
-				if not os.path.exists(coop_results_dir):
-					os.makedirs(coop_results_dir)
-
-				for coop_result in coop_results:
-					filename = coop_result["data"]["coopHistoryDetail"]["playedTime"].replace("-", "").replace(":", "") + ".json"
-					out_path = os.path.join(coop_results_dir, filename)
-					if not os.path.exists(out_path):
-						with open(out_path, "x") as fout:
-							json.dump(coop_result, fout)
-				print("Updated coop_results directory with recent Salmon Run jobs (up to 50).")
-
+		export_results(skipprefetch, db_path=db_path)
 		print("\nHave fun playing Splatoon 3! :) Bye!")
 		sys.exit(0)
 
 	# manual json upload: -i flag
 	#############################
+	if file_paths and len(file_paths) == 1 and resultdb.is_result_db(file_paths[0]): # result store from -o --db
+		which = "ink" if only_ink else "salmon" if only_salmon else "both"
+		import_from_db(file_paths[0], which, db_filters, blackout, test_run)
+		sys.exit(0)
+	elif file_paths and len(file_paths) != 2:
+		print("Must pass in a results folder and an overview.json, or a single result store from --db. Exiting.")
+		sys.exit(1)
+
 	if file_paths: # 2 paths in list
+		if DEBUG:
+			tracemalloc.start() # measure allocation churn/peak memory for large imports
 		if not utils.custom_key_exists("old_export_format", CONFIG_DATA):
 			if os.path.dirname(os.path.join(file_paths[0], ''))[-7:] != "results" \
 			or os.path.basename(file_paths[1])[:8] != "overview":
@@ -1970,13 +2927,9 @@ def main():
 				sys.exit(1)
 
 		# argument #1 - results folder or file
-		if not utils.custom_key_exists("old_export_format", CONFIG_DATA):
-			data = []
-			for json_file in os.listdir(file_paths[0]):
-				if json_file.endswith('.json'): # just in case
-					with open(os.path.join(file_paths[0], json_file)) as data_file:
-						contents = json.load(data_file)
-						data.append(contents)
+		old_format = utils.custom_key_exists("old_export_format", CONFIG_DATA)
+		if not old_format: # read lazily, oldest first - only one result is held at a time (see archive.stream_results())
+			data = archive.stream_results(file_paths[0])
 		else: #old method
 			with open(file_paths[0]) as data_file:
 				try:
@@ -1986,62 +2939,32 @@ def main():
 					sys.exit(1)
 
 		# argument #2 - overview.json
-		with open(file_paths[1]) as data_file:
-			try:
-				overview_file = json.load(data_file)
-			except ValueError:
-				print("Could not decode JSON object in your overview.json.")
-				sys.exit(1)
-		data.reverse()
-
-		# only upload unuploaded results
-		auth = {'Authorization': f'Bearer {API_KEY}'}
-		resp_b = requests.get("https://stat.ink/api/v3/s3s/uuid-list?lobby=adaptive", headers=auth)
-		resp_j = requests.get("https://stat.ink/api/v3/salmon/uuid-list", headers=auth)
 		try:
-			statink_uploads = json.loads(resp_b.text)
-			statink_uploads.extend(json.loads(resp_j.text))
-		except:
-			print(f"Encountered an error while checking recently-uploaded data. Is stat.ink down?")
+			overview_file = archive.read_overview(file_paths[1])
+		except (ValueError, OSError, EOFError):
+			print("Could not decode JSON object in your overview.json.")
 			sys.exit(1)
 
-		to_upload = []
-		for result in data:
-			try: # ink battle
-				if result["data"]["vsHistoryDetail"] is not None:
-					full_id = utils.b64d(result["data"]["vsHistoryDetail"]["id"])
-					old_uuid = full_id[-36:] # not unique because nintendo hates us
-					new_uuid = str(uuid.uuid5(utils.S3S_NAMESPACE, full_id[-52:]))
-
-					if new_uuid in statink_uploads:
-						print("Skipping already-uploaded battle.")
-						continue
-					if old_uuid in statink_uploads:
-						if not utils.custom_key_exists("force_uploads", CONFIG_DATA):
-							print("Skipping already-uploaded battle (use the `force_uploads` config key to override).")
-							continue
-					to_upload.append(result)
-
-			except KeyError: # salmon run job
-				if result["data"]["coopHistoryDetail"] is not None:
-					full_id = utils.b64d(result["data"]["coopHistoryDetail"]["id"])
-					old_uuid = str(uuid.uuid5(utils.SALMON_NAMESPACE, full_id[-52:]))
-					new_uuid = str(uuid.uuid5(utils.SALMON_NAMESPACE, full_id))
-
-					if new_uuid in statink_uploads:
-						print("Skipping already-uploaded job.")
-						continue
-					if old_uuid in statink_uploads:
-						if not utils.custom_key_exists("force_uploads", CONFIG_DATA):
-							print("Skipping already-uploaded job (use the `force_uploads` config key to override).")
-							continue
-
-					to_upload.append(result)
+		if watch_mode: # keep uploading whatever gets written into the folder
+			if old_format or not os.path.isdir(file_paths[0]):
+				print("--watch needs a results folder to watch. Exiting.")
+				sys.exit(1)
+			watch_folder(file_paths[0], file_paths[1], overview_file, blackout, test_run)
+			sys.exit(0)
 
-		if len(to_upload) == 0:
+		# only upload unuploaded results
+		statink_uploads, sent = statink_uuid_list(), set()
+
+		# each result is checked, converted & uploaded before the next one is read
+		to_upload = not_on_statink(data, statink_uploads, sent)
+		if old_format:
+			to_upload = list(to_upload) # all in one file anyway - post_result() sorts it
+		post_result(to_upload, False, blackout, test_run, overview_data=overview_file) # one or multiple; monitoring mode = False
+		if not sent:
 			print("Nothing to upload that isn't already on stat.ink.")
-		else:
-			post_result(to_upload, False, blackout, test_run, overview_data=overview_file) # one or multiple; monitoring mode = False
+		if DEBUG:
+			current_mem, peak_mem = tracemalloc.get_traced_memory()
+			print(f"* memory: {current_mem // 1024} KiB current, {peak_mem // 1024} KiB peak")
 		sys.exit(0)
 
 	# regular run
@@ -2051,16 +2974,26 @@ def main():
 	# if which in ("salmon", "both"):
 	# 	update_salmon_profile() # not a thing for spl3, done on stat.ink's end
 
+	if accounts is not None:
+		accounts = load_accounts(accounts)
+
+	if sync: # cron-friendly incremental mode
+		sync_results(which, blackout, test_run, skipprefetch, force_full=check_old)
+		sys.exit(0)
+
 	if check_old:
-		if which == "both":
-			prefetch_checks(printout=True)
-			skipprefetch = True
-		check_if_missing(which, blackout, test_run, skipprefetch) # monitoring mode hasn't begun yet
-		print()
+		for account in accounts or [None]:
+			use_account(account)
+			if accounts:
+				print(f"== {account} ==")
+			if which == "both":
+				prefetch_checks(printout=True)
+			check_if_missing(which, blackout, test_run, skipprefetch or which == "both") # monitoring mode hasn't begun yet
+			print()
 
 	if secs != -1: # monitoring mode
 		skipprefetch = True if skipprefetch or check_old else False
-		monitor_battles(which, secs, blackout, test_run, skipprefetch) # skip prefetch checks if already done in -r
+		monitor_battles(which, secs, blackout, test_run, skipprefetch, accounts, daemon_port) # skip prefetch checks if already done in -r
 
 	elif not check_old: # regular mode (no -M) and did not just use -r
 		if which == "both":
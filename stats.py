@@ -0,0 +1,329 @@
+# (ↄ) 2017-2024 eli fessler (frozenpandaman), clovervidia
+# https://github.com/frozenpandaman/s3s
+# License: GPLv3
+
+import json, os, sys
+import archive, resultdb, utils
+
+CACHE_VERSION = 1
+CACHE_NAME    = "stats_cache.npz" # kept in the export folder; `<file>.stats.npz` next to a --db result store
+
+# one array per column; categorical columns hold codes into a shared vocabulary (-1 = missing)
+COLUMNS = {
+	"battle": {"played": "i8", "mode": "i2", "rule": "i2", "stage": "i2", "weapon": "i2", "udemae": "i2",
+		"result": "i1", "kill": "i2", "assist": "i2", "death": "i2", "special": "i2", "x_power": "f8"},
+	"job":    {"played": "i8", "rule": "i2", "stage": "i2", "weapon": "i2", "cleared": "i1", "clear_waves": "i1",
+		"golden_eggs": "i4", "my_golden_eggs": "i4", "power_eggs": "i4", "danger_rate": "f8"},
+	"wave":   {"job": "i4", "wave": "i1", "water_level": "i1", "event": "i2", "delivered": "i4", "quota": "i4"}
+}
+CATEGORICAL = ("mode", "rule", "stage", "weapon", "udemae", "event")
+RESULT_CODES = {"WIN": 1, "LOSE": 0, "DEEMED_LOSE": 0} # draws & exempted losses (-1) don't count toward win rates
+WATER_LEVELS = ("Low Tide", "Normal", "High Tide")
+UNKNOWN      = "unknown" # vocabulary entry for a battle's mode or rule when splatnet doesn't give one
+
+
+def numpy_available():
+	'''Checks whether the optional numpy module is installed.'''
+
+	try:
+		import numpy
+		return True
+	except ModuleNotFoundError:
+		return False
+
+
+class StatsCache:
+	'''Columnar (numpy array) copy of an export's results, saved between runs and only ever extended with new ones.'''
+
+	def __init__(self, path):
+		import numpy as np
+		self.np      = np
+		self.path    = path
+		self.columns = {kind: {name: np.zeros(0, dtype) for name, dtype in cols.items()} for kind, cols in COLUMNS.items()}
+		self.vocab   = {name: [] for name in CATEGORICAL}
+		self.ids     = set() # index keys (archive.segment_key()) of every result in the cache
+		self.sources = set() # loose export files already read
+		self.offsets = {}    # how far into each appended-to .ndjson archive has been read
+		self.db_rowid = 0    # last result store row read
+		self._pending = {kind: {name: [] for name in cols} for kind, cols in COLUMNS.items()}
+		self.added    = 0
+		self._load()
+
+	def _load(self):
+		np = self.np
+		try:
+			saved = np.load(self.path, allow_pickle=False)
+			meta = json.loads(str(saved["meta"]))
+		except (OSError, ValueError, KeyError):
+			return
+		if meta.get("version") != CACHE_VERSION:
+			return # rebuilt from scratch
+		for kind, cols in COLUMNS.items():
+			for name in cols:
+				self.columns[kind][name] = saved[f"{kind}_{name}"]
+		self.vocab    = meta["vocab"]
+		self.sources  = set(source for source in meta["sources"] if ".ndjson" not in source) # see load_archive()
+		self.offsets  = meta.get("offsets", {})
+		self.db_rowid = meta["db_rowid"]
+		self.ids      = set(row.tobytes() for row in saved["ids"])
+
+	def __len__(self):
+		return len(self.columns["battle"]["played"]) + len(self.columns["job"]["played"])
+
+	def _code(self, name, value):
+		if value is None:
+			return -1
+		vocab = self.vocab[name]
+		try:
+			return vocab.index(value)
+		except ValueError:
+			vocab.append(value)
+			return len(vocab) - 1
+
+	def add(self, result):
+		'''Queues a result (from fetch_json() or an export) to be appended as a row. Already-cached ones are skipped.'''
+		data = result.get("data") or {}
+		detail = data.get("vsHistoryDetail") or data.get("coopHistoryDetail")
+		if detail is None:
+			return
+		key = archive.segment_key(detail["id"])
+		if key in self.ids:
+			return
+		self.ids.add(key)
+		self.added += 1
+		played = utils.epoch_time(detail["playedTime"])
+
+		if data.get("vsHistoryDetail"):
+			row = self._pending["battle"]
+			me = next((player for player in (detail.get("myTeam") or {}).get("players", []) if player["isMyself"]), {})
+			scores = me.get("result") or {} # null if player disconnect
+			row["played"].append(played)
+			# vsMode/vsRule are null for some results - still counted, under "unknown"
+			row["mode"].append(self._code("mode", (detail.get("vsMode") or {}).get("mode") or UNKNOWN))
+			row["rule"].append(self._code("rule", (detail.get("vsRule") or {}).get("rule") or UNKNOWN))
+			row["stage"].append(self._code("stage", (detail.get("vsStage") or {}).get("name")))
+			row["weapon"].append(self._code("weapon", (me.get("weapon") or {}).get("name")))
+			row["udemae"].append(self._code("udemae", detail.get("udemae")))
+			row["result"].append(RESULT_CODES.get(detail.get("judgement"), -1))
+			row["kill"].append(scores["kill"] - scores["assist"] if scores else -1) # "kill" is kills + assists
+			row["assist"].append(scores.get("assist", -1))
+			row["death"].append(scores.get("death", -1))
+			row["special"].append(scores.get("special", -1))
+			x_power = (detail.get("xMatch") or {}).get("lastXPower")
+			row["x_power"].append(float("nan") if x_power is None else x_power)
+		else:
+			row = self._pending["job"]
+			job_index = len(self.columns["job"]["played"]) + len(row["played"])
+			my_result = detail.get("myResult") or {}
+			wave_results = detail.get("waveResults") or []
+			weapons = my_result.get("weapons") or [{}]
+			max_waves = 5 if detail.get("rule") == "TEAM_CONTEST" else 3
+			waves_cleared = max_waves if detail["resultWave"] == 0 else max(detail["resultWave"] - 1, -1)
+			row["played"].append(played)
+			row["rule"].append(self._code("rule", detail.get("rule")))
+			row["stage"].append(self._code("stage", (detail.get("coopStage") or {}).get("name")))
+			row["weapon"].append(self._code("weapon", weapons[0].get("name")))
+			row["cleared"].append(1 if detail["resultWave"] == 0 else 0)
+			row["clear_waves"].append(waves_cleared)
+			row["golden_eggs"].append(sum(wave["teamDeliverCount"] or 0 for wave in wave_results))
+			row["my_golden_eggs"].append(my_result.get("goldenDeliverCount") or 0)
+			row["power_eggs"].append(my_result.get("deliverCount") or 0)
+			row["danger_rate"].append(detail["dangerRate"] * 100 if detail.get("dangerRate") is not None else float("nan"))
+
+			waves = self._pending["wave"]
+			for wave in wave_results:
+				waves["job"].append(job_index)
+				waves["wave"].append(wave["waveNumber"])
+				waves["water_level"].append(wave["waterLevel"] if wave.get("waterLevel") is not None else -1)
+				waves["event"].append(self._code("event", (wave.get("eventWave") or {}).get("name")))
+				waves["delivered"].append(wave["teamDeliverCount"] if wave["teamDeliverCount"] is not None else -1)
+				waves["quota"].append(wave["deliverNorm"] if wave.get("deliverNorm") is not None else -1) # none for xtrawave
+
+	def flush(self):
+		'''Appends the queued rows to the column arrays.'''
+		np = self.np
+		for kind, cols in COLUMNS.items():
+			if self._pending[kind]["played" if kind != "wave" else "job"]:
+				for name, dtype in cols.items():
+					new = np.array(self._pending[kind][name], dtype=dtype)
+					self.columns[kind][name] = np.concatenate((self.columns[kind][name], new))
+			self._pending[kind] = {name: [] for name in cols}
+
+	def save(self):
+		'''Writes the cache out atomically.'''
+		np = self.np
+		self.flush()
+		arrays = {f"{kind}_{name}": array for kind, cols in self.columns.items() for name, array in cols.items()}
+		arrays["ids"] = np.frombuffer(b"".join(sorted(self.ids)), dtype=np.uint8).reshape(-1, 31)
+		arrays["meta"] = np.array(json.dumps({"version": CACHE_VERSION, "vocab": self.vocab,
+			"sources": sorted(self.sources), "offsets": self.offsets, "db_rowid": self.db_rowid}))
+		tmp_path = f"{self.path}.tmp.npz"
+		np.savez_compressed(tmp_path, **arrays)
+		os.replace(tmp_path, self.path)
+
+
+def load_archive(path):
+	'''Returns a StatsCache for an export folder (or --db result store), reading only results that are new to the cache.'''
+
+	if resultdb.is_result_db(path):
+		cache = StatsCache(f"{path}.stats.npz")
+		db = resultdb.ResultDB(path)
+		for rowid, result in db.rows_after(cache.db_rowid):
+			cache.add(result)
+			cache.db_rowid = rowid
+		db.close()
+	else:
+		cache = StatsCache(os.path.join(path, CACHE_NAME))
+		if os.path.basename(os.path.normpath(path)) in ("results", "coop_results"):
+			folders = [path]
+		else: # exports/ from -o
+			folders = [os.path.join(path, folder) for folder in ("results", "coop_results")]
+		for folder in folders:
+			if not os.path.isdir(folder):
+				continue
+			for filename in sorted(os.listdir(folder)):
+				source = os.path.join(os.path.basename(folder), filename)
+				if not archive.is_result_file(filename) or source in cache.sources:
+					continue
+				file_path = os.path.join(folder, filename)
+				try:
+					# .ndjson archives keep growing with each -o - resume a plain one where we left off, and read a
+					# gzipped one again in full (results already in the cache are skipped)
+					if filename.endswith(".ndjson"):
+						offset = cache.offsets.get(source, 0)
+						if os.path.getsize(file_path) < offset: # replaced since
+							offset = 0
+						results, cache.offsets[source] = archive.read_ndjson_from(file_path, offset)
+					else:
+						results = archive.read_results(file_path)
+					for result in results:
+						cache.add(result)
+				except (IOError, ValueError, EOFError):
+					print(f"(!) Could not read {filename} - skipping.")
+					continue
+				if ".ndjson" not in filename:
+					cache.sources.add(source)
+			if os.path.exists(os.path.join(folder, archive.SEGMENT_INDEX)): # packed with --compact
+				segments = archive.SegmentArchive(folder)
+				for result in segments.results(skip_keys=cache.ids):
+					cache.add(result)
+				segments.close()
+
+	if cache.added:
+		cache.save()
+	return cache
+
+
+def _rates_by(np, codes, outcome, vocab, top=10):
+	'''Returns [(name, games, rate)] for each category, most played first; outcome is 1/0, or -1 to leave it out.'''
+
+	counted = (codes >= 0) & (outcome >= 0)
+	games = np.bincount(codes[counted], minlength=len(vocab))
+	wins = np.bincount(codes[counted], weights=outcome[counted], minlength=len(vocab))
+	order = np.argsort(-games, kind="stable")[:top]
+	return [(vocab[i], int(games[i]), wins[i] / games[i]) for i in order if games[i] > 0]
+
+
+def _distribution(np, values):
+	'''Returns mean, median & 90th percentile, leaving out missing (-1/nan) values.'''
+
+	values = values[values >= 0].astype("f8")
+	if len(values) == 0:
+		return None
+	return values.mean(), np.median(values), np.percentile(values, 90)
+
+
+def _by_month(np, played):
+	'''Returns (sorted unique months, each row's month #) for an array of epoch times.'''
+
+	months = played.astype("datetime64[s]").astype("datetime64[M]")
+	return np.unique(months, return_inverse=True)
+
+
+def print_report(cache):
+	'''Prints aggregate stats over everything in the cache.'''
+
+	np = cache.np
+	vocab = cache.vocab
+	battles, jobs, waves = cache.columns["battle"], cache.columns["job"], cache.columns["wave"]
+
+	def rate_table(title, rows):
+		if rows:
+			print(f"\n{title}")
+			for name, games, rate in rows:
+				print(f"  {name:<32} {games:>6}  {rate:6.1%}")
+
+	n_battles = len(battles["played"])
+	if n_battles:
+		counted = battles["result"] >= 0
+		print(f"\n== Battles: {n_battles} ==")
+		if counted.any():
+			print(f"Win rate: {battles['result'][counted].mean():.1%} ({int(counted.sum())} counted)")
+		rate_table("Win rate by mode:", _rates_by(np, battles["mode"], battles["result"], vocab["mode"]))
+		rate_table("Win rate by rule:", _rates_by(np, battles["rule"], battles["result"], vocab["rule"]))
+		rate_table("Win rate by stage:", _rates_by(np, battles["stage"], battles["result"], vocab["stage"]))
+		rate_table("Win rate by weapon (top 10):", _rates_by(np, battles["weapon"], battles["result"], vocab["weapon"]))
+
+		print("\nPer battle:          mean   median   90th %")
+		for name in ("kill", "assist", "death", "special"):
+			dist = _distribution(np, battles[name])
+			if dist is not None:
+				print(f"  {name:<16} {dist[0]:7.2f}  {dist[1]:7.1f}  {dist[2]:7.1f}")
+
+		has_power = ~np.isnan(battles["x_power"])
+		if has_power.any():
+			months, month_of = _by_month(np, battles["played"][has_power])
+			totals = np.bincount(month_of, weights=battles["x_power"][has_power])
+			counts = np.bincount(month_of)
+			peaks = np.full(len(months), -np.inf)
+			np.maximum.at(peaks, month_of, battles["x_power"][has_power])
+			print("\nX Power by month:    mean      max")
+			for month, total, count, peak in zip(months, totals, counts, peaks):
+				print(f"  {str(month):<16} {total / count:7.1f}  {peak:7.1f}")
+
+		ranked = battles["udemae"] >= 0
+		if ranked.any():
+			played, udemae = battles["played"][ranked], battles["udemae"][ranked]
+			order = np.argsort(played, kind="stable")[::-1] # newest first, so the first per month is its latest
+			months, first = np.unique(played[order].astype("datetime64[s]").astype("datetime64[M]"), return_index=True)
+			print("\nRank at end of month:")
+			for month, i in zip(months, first):
+				print(f"  {str(month):<16} {vocab['udemae'][udemae[order][i]]}")
+
+	n_jobs = len(jobs["played"])
+	if n_jobs:
+		print(f"\n== Salmon Run jobs: {n_jobs} ==")
+		print(f"Clear rate: {jobs['cleared'].mean():.1%}")
+		rate_table("Clear rate by rule:", _rates_by(np, jobs["rule"], jobs["cleared"], vocab["rule"]))
+		rate_table("Clear rate by stage:", _rates_by(np, jobs["stage"], jobs["cleared"], vocab["stage"]))
+
+		print("\nPer job:             mean   median   90th %")
+		for name, label in (("golden_eggs", "team golden"), ("my_golden_eggs", "golden eggs"),
+			("power_eggs", "power eggs"), ("clear_waves", "waves cleared")):
+			dist = _distribution(np, jobs[name])
+			if dist is not None:
+				print(f"  {label:<16} {dist[0]:7.2f}  {dist[1]:7.1f}  {dist[2]:7.1f}")
+		danger = jobs["danger_rate"][~np.isnan(jobs["danger_rate"])]
+		if len(danger):
+			print(f"  {'hazard level':<16} {danger.mean():7.2f}  {np.median(danger):7.1f}  {np.percentile(danger, 90):7.1f}")
+
+		with_quota = waves["quota"] > 0 # leaves out xtrawaves
+		met = (waves["delivered"] >= waves["quota"]).astype("i1")
+		met[~with_quota] = -1
+		tides = _rates_by(np, waves["water_level"].astype("i2"), met, list(WATER_LEVELS))
+		rate_table("Quota met by tide:", tides)
+		event = np.where(waves["event"] >= 0, waves["event"] + 1, 0).astype("i2") # 0 = no event
+		rate_table("Quota met by event:", _rates_by(np, event, met, ["(none)"] + vocab["event"]))
+		eggs_per_wave = np.bincount(waves["wave"][with_quota], weights=waves["delivered"][with_quota])
+		waves_played = np.bincount(waves["wave"][with_quota])
+		print("\nGolden eggs by wave:")
+		for wave in np.nonzero(waves_played)[0]:
+			print(f"  Wave {wave:<11} {eggs_per_wave[wave] / waves_played[wave]:7.2f}")
+
+	if not n_battles and not n_jobs:
+		print("No results found.")
+
+
+if __name__ == "__main__":
+	print("This program cannot be run alone. See https://github.com/frozenpandaman/s3s")
+	sys.exit(0)
@@ -0,0 +1,13 @@
+import outbox
+
+
+def test_same_result_from_two_accounts_is_queued_twice(tmp_path):
+	box = outbox.Outbox(str(tmp_path / "outbox"))
+	keys = [box.put("ink", "0b4b9b4e-0000-5000-8000-000000000000", payload, account)
+		for payload, account in ((b"alice's", "alice"), (b"bob's", "bob"), (b"main", None))]
+	assert len(set(keys)) == 3
+	assert len(box) == 3
+	queued = {item["account"]: item["payload"] for key, item in box.pending()}
+	assert queued == {"alice": b"alice's", "bob": b"bob's", None: b"main"}
+	for key, item in box.pending():
+		assert box.key(item["which"], item["uuid"], item["account"]) == key
@@ -0,0 +1,23 @@
+import base64
+import resultdb
+
+
+def battle(day, vs_mode={"mode": "BANKARA"}, vs_rule={"rule": "AREA"}):
+	raw_id = f"VsHistoryDetail-u-aaaaaaaaaaaaaaaaaaaa:RECENT:202401{day:02d}T000000_0123456789abcdef0123456789ab{day:04d}"
+	return {"data": {"vsHistoryDetail": {
+		"id":         base64.b64encode(raw_id.encode("utf-8")).decode("ascii"),
+		"playedTime": f"2024-01-{day:02d}T00:00:00Z",
+		"vsMode":     vs_mode,
+		"vsRule":     vs_rule,
+		"judgement":  "WIN"
+	}}}
+
+
+def test_add_result_with_null_vs_mode(tmp_path):
+	db = resultdb.ResultDB(str(tmp_path / "results.db"))
+	assert db.add_result(battle(1))
+	assert db.add_result(battle(2, vs_mode=None, vs_rule=None))
+	assert db.count(kind="battle") == 2
+	assert db.count(kind="battle", mode="BANKARA") == 1
+	assert [result["data"]["vsHistoryDetail"]["vsMode"] for result in db.query()] == [{"mode": "BANKARA"}, None]
+	db.close()
@@ -0,0 +1,29 @@
+import base64
+import pytest
+import stats
+
+np = pytest.importorskip("numpy")
+
+
+def battle(day, vs_mode={"mode": "BANKARA"}, vs_rule={"rule": "AREA"}, judgement="WIN"):
+	raw_id = f"VsHistoryDetail-u-aaaaaaaaaaaaaaaaaaaa:RECENT:202401{day:02d}T000000_0123456789abcdef0123456789ab{day:04d}"
+	return {"data": {"vsHistoryDetail": {
+		"id":         base64.b64encode(raw_id.encode("utf-8")).decode("ascii"),
+		"playedTime": f"2024-01-{day:02d}T00:00:00Z",
+		"vsMode":     vs_mode,
+		"vsRule":     vs_rule,
+		"judgement":  judgement
+	}}}
+
+
+def test_null_vs_mode_is_counted_as_unknown(tmp_path):
+	cache = stats.StatsCache(str(tmp_path / stats.CACHE_NAME))
+	cache.add(battle(1))
+	cache.add(battle(2, vs_mode=None, vs_rule=None, judgement="LOSE"))
+	cache.flush()
+	battles = cache.columns["battle"]
+	assert len(battles["played"]) == 2
+	assert [cache.vocab["mode"][code] for code in battles["mode"]] == ["BANKARA", stats.UNKNOWN]
+	assert [cache.vocab["rule"][code] for code in battles["rule"]] == ["AREA", stats.UNKNOWN]
+	cache.save()
+	assert len(stats.StatsCache(cache.path)) == 2
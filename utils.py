@@ -2,7 +2,7 @@
 # https://github.com/frozenpandaman/s3s
 # License: GPLv3
 
-import base64, datetime, json, re, sys, uuid
+import base64, collections, contextlib, datetime, heapq, itertools, json, os, random, re, sys, threading, time, uuid
 import requests
 from bs4 import BeautifulSoup
 
@@ -15,7 +15,17 @@ SUPPORTED_KEYS = [
 	"app_user_agent",
 	"force_uploads",
 	"errors_pass_silently",
-	"old_export_format"
+	"old_export_format",
+	"filter_modes",
+	"filter_rules",
+	"filter_since",
+	"filter_until",
+	"payload_profile",
+	"compress_uploads",
+	"sync_full_hours",
+	"export_format",
+	"overview_chunks",
+	"result_buffer_mb"
 ]
 
 # SHA256 hash database for SplatNet 3 GraphQL queries
@@ -127,6 +137,43 @@ def b64d(string):
 		return int(thing_id) # integer
 
 
+def normalize_battle_id(b64_id):
+	'''Base64-decodes a battle ID and normalizes its mode segment, so the same battle matches across history screens.'''
+
+	battle_id = base64.b64decode(b64_id).decode('utf-8')
+	return battle_id.replace("BANKARA", "RECENT").replace("XMATCH", "RECENT") # make work with -M and -r
+
+
+_overview_index_cache = (None, None) # (overview_data, index) - same data is passed in for every result with -i
+
+
+def index_overview(overview_data):
+	'''Parses overview (query1) screens into lookups from normalized battle ID to (group, position, node), once per overview.'''
+
+	global _overview_index_cache
+	if _overview_index_cache[0] is overview_data:
+		return _overview_index_cache[1]
+
+	ranked_list, x_list = None, None
+	for screen in overview_data:
+		if ranked_list is None:
+			if "bankaraBattleHistories" in screen["data"]:
+				ranked_list = screen["data"]["bankaraBattleHistories"]["historyGroups"]["nodes"]
+			elif "latestBattleHistories" in screen["data"]: # early exports used this, and no bankaraMatchChallenge
+				ranked_list = screen["data"]["latestBattleHistories"]["historyGroups"]["nodes"]
+		if x_list is None and "xBattleHistories" in screen["data"]:
+			x_list = screen["data"]["xBattleHistories"]["historyGroups"]["nodes"]
+
+	index = {"bankara": {}, "x": {}}
+	for kind, groups in (("bankara", ranked_list or []), ("x", x_list or [])):
+		for parent in groups: # groups in overview JSON/screen
+			for idx, child in enumerate(parent["historyDetails"]["nodes"]):
+				index[kind].setdefault(normalize_battle_id(child["id"]), (parent, idx, child))
+
+	_overview_index_cache = (overview_data, index)
+	return index
+
+
 def epoch_time(time_string):
 	'''Converts a playedTime string into an integer representing the epoch time.'''
 
@@ -135,6 +182,344 @@ def epoch_time(time_string):
 	return epoch_time
 
 
+class Record:
+	'''Compact base for intermediate payload data. Only fields that were set get serialized, like a sparse dict.'''
+
+	__slots__ = ()
+
+	def __init__(self, **fields):
+		for key, value in fields.items():
+			setattr(self, key, value)
+
+	def __getitem__(self, key):
+		if key not in self.__slots__ or not hasattr(self, key):
+			raise KeyError(key)
+		return getattr(self, key)
+
+	def __setitem__(self, key, value):
+		setattr(self, key, value) # AttributeError on fields stat.ink doesn't know about
+
+	def __contains__(self, key):
+		return key in self.__slots__ and hasattr(self, key)
+
+	def get(self, key, default=None):
+		return self[key] if key in self else default
+
+	def to_dict(self):
+		return {key: getattr(self, key) for key in self.__slots__ if hasattr(self, key)}
+
+
+# https://github.com/fetus-hina/stat.ink/wiki/Spl3-API:-Battle-%EF%BC%8D-Post#player-structure
+class PlayerRecord(Record):
+	__slots__ = ("me", "name", "number", "splashtag_title", "weapon", "inked", "species", "rank_in_team", "crown_type",
+		"kill_or_assist", "assist", "kill", "death", "special", "signal", "disconnected", "crown", "gears")
+
+# https://github.com/fetus-hina/stat.ink/wiki/Spl3-API:-Battle-%EF%BC%8D-Post#gears-structure
+class GearsRecord(Record):
+	__slots__ = ("headgear", "clothing", "shoes")
+
+class GearRecord(Record):
+	__slots__ = ("primary_ability", "secondary_abilities")
+
+# https://github.com/fetus-hina/stat.ink/wiki/Spl3-API:-Salmon-%EF%BC%8D-Post
+class JobPlayerRecord(Record):
+	__slots__ = ("me", "name", "number", "splashtag_title", "golden_eggs", "golden_assist", "power_eggs", "rescue",
+		"rescued", "defeat_boss", "species", "disconnected", "uniform", "special", "weapons")
+
+class WaveRecord(Record):
+	__slots__ = ("tide", "golden_quota", "golden_delivered", "golden_appearances", "danger_rate", "event", "special_uses")
+
+class BossRecord(Record):
+	__slots__ = ("appearances", "defeated", "defeated_by_me")
+
+
+def pack_record(obj):
+	'''msgpack `default` hook - serializes Record objects straight into the upload payload.'''
+
+	if isinstance(obj, Record):
+		return obj.to_dict()
+	raise TypeError(f"Cannot serialize {type(obj).__name__} object")
+
+
+def compact_id(b64_id):
+	'''Shrinks a battle/job ID to the part that identifies it - its timestamp + UUID - packed into 31 bytes.'''
+
+	try:
+		full_id = base64.b64decode(b64_id).decode('utf-8')
+		timestamp, result_uuid = full_id[-52:].split("_") # <YYYYMMDD>T<HHMMSS>_<uuid>
+		return timestamp.encode('ascii') + uuid.UUID(result_uuid).bytes
+	except (ValueError, UnicodeError): # unexpected format - keep the whole thing
+		return b64_id.encode('utf-8')
+
+
+class SeenIds:
+	'''Bounded, insertion-ordered set of battle/job IDs already handled, stored in compact form (see compact_id()).'''
+
+	# splatnet only keeps 50 results per history list, so older ones can never show up again
+	def __init__(self, ids=(), maxlen=100):
+		self.maxlen = maxlen
+		self._ids = collections.OrderedDict()
+		for b64_id in ids:
+			self.add(b64_id)
+
+	def __contains__(self, b64_id):
+		return compact_id(b64_id) in self._ids
+
+	def __len__(self):
+		return len(self._ids)
+
+	def add(self, b64_id):
+		self._add_compact(compact_id(b64_id))
+
+	def _add_compact(self, key):
+		self._ids[key] = None
+		while len(self._ids) > self.maxlen:
+			self._ids.popitem(last=False) # evict oldest
+
+	def to_list(self):
+		'''Returns the compact IDs, oldest first, as JSON-safe strings.'''
+		return [base64.b64encode(key).decode('ascii') for key in self._ids]
+
+	@classmethod
+	def from_list(cls, keys, maxlen=100):
+		'''Rebuilds a SeenIds from the output of to_list().'''
+		seen = cls(maxlen=maxlen)
+		for key in keys:
+			seen._add_compact(base64.b64decode(key))
+		return seen
+
+
+class PollSchedule:
+	'''Adaptive polling interval for one result stream (battles or jobs) in monitoring mode.'''
+
+	# starts at `base` secs, backs off by 1.5x per idle check up to `max_interval`, and snaps back after a new result
+	def __init__(self, base, max_interval=None, jitter=0.1):
+		self.base         = base
+		self.max_interval = max_interval or max(base, min(base*4, 1800))
+		self.jitter       = jitter
+		self.interval     = base
+		self.next_due     = 0
+		self.schedule()
+
+	def schedule(self):
+		# jitter only ever delays a check, so polls never come sooner than the interval (and -M's 60 sec minimum)
+		self.next_due = time.time() + self.interval + random.uniform(0, self.interval * self.jitter)
+
+	def record(self, found_new):
+		'''Updates the interval after a check and schedules the next one.'''
+		if found_new:
+			self.interval = self.base # playing right now - likely more soon
+		else:
+			self.interval = min(self.interval * 1.5, self.max_interval)
+		self.schedule()
+
+
+class PriorityGate:
+	'''Lets up to `slots` requests through at once, serving waiters by priority (lower first), with aging so none starve.'''
+
+	# a waiter's effective priority improves by one level per `aging` secs spent waiting
+	def __init__(self, slots=2, aging=5):
+		self.slots   = slots
+		self.aging   = aging
+		self.cond    = threading.Condition()
+		self.busy    = 0
+		self.waiting = [] # (priority, seq, enqueued at)
+		self.seq     = itertools.count()
+
+	def _next(self):
+		now = time.monotonic()
+		return min(self.waiting, key=lambda ticket: (ticket[0] - (now - ticket[2]) / self.aging, ticket[1]))
+
+	@contextlib.contextmanager
+	def slot(self, priority):
+		'''Blocks until it's this caller's turn, then yields the secs spent waiting.'''
+		enqueued = time.monotonic()
+		ticket = (priority, next(self.seq), enqueued)
+		with self.cond:
+			self.waiting.append(ticket)
+			while self.busy >= self.slots or self._next() is not ticket:
+				self.cond.wait(timeout=self.aging) # re-rank periodically as waiters age
+			self.waiting.remove(ticket)
+			self.busy += 1
+			self.cond.notify_all() # a free slot might be left for the next in line
+		try:
+			yield time.monotonic() - enqueued
+		finally:
+			with self.cond:
+				self.busy -= 1
+				self.cond.notify_all()
+
+
+class Metrics:
+	'''Thread-safe counters, gauges & timings, rendered in the Prometheus text format for daemon mode.'''
+
+	def __init__(self, prefix="s3s"):
+		self.prefix = prefix
+		self.lock   = threading.Lock()
+		self.kinds  = {} # metric name -> "counter", "gauge" or "summary"
+		self.values = {} # metric name -> {sorted label items: value}
+
+	def _update(self, kind, name, labels, value, replace=False):
+		key = tuple(sorted(labels.items()))
+		with self.lock:
+			self.kinds.setdefault(name, kind)
+			series = self.values.setdefault(name, {})
+			series[key] = value if replace else series.get(key, 0) + value
+
+	def inc(self, name, value=1, **labels):
+		self._update("counter", name, labels, value)
+
+	def set(self, name, value, **labels):
+		self._update("gauge", name, labels, value, replace=True)
+
+	def observe(self, name, seconds, **labels):
+		'''Records one timing (e.g. a poll's latency) as a count & sum.'''
+		key = tuple(sorted(labels.items()))
+		with self.lock:
+			self.kinds.setdefault(name, "summary")
+			count, total = self.values.setdefault(name, {}).get(key, (0, 0))
+			self.values[name][key] = (count + 1, total + seconds)
+
+	def render(self):
+		'''Returns all metrics in the Prometheus text exposition format.'''
+		with self.lock:
+			snapshot = {name: dict(series) for name, series in self.values.items()}
+
+		lines = []
+		for name in sorted(snapshot):
+			full_name = f"{self.prefix}_{name}"
+			lines.append(f"# TYPE {full_name} {self.kinds[name]}")
+			for key, value in sorted(snapshot[name].items()):
+				labels = "{" + ",".join(f'{k}="{v}"' for k, v in key) + "}" if key else ""
+				if self.kinds[name] == "summary":
+					lines.append(f"{full_name}_count{labels} {value[0]}")
+					lines.append(f"{full_name}_sum{labels} {round(value[1], 6)}")
+				else:
+					lines.append(f"{full_name}{labels} {value}")
+		return "\n".join(lines) + "\n"
+
+
+# base64 of "VsHistoryDetail-" and "CoopHistoryDetail-" - battle & job IDs all start with these
+DETAIL_ID_RE = re.compile(r'"(VnNIaXN0b3J5RGV0YWlsL[A-Za-z0-9+/=]+|Q29vcEhpc3RvcnlEZXRhaWwt[A-Za-z0-9+/=]+)"')
+
+
+def peek_first_id(response_text):
+	'''Returns the first battle/job ID in a raw query1 response without parsing it, or None. Changes whenever a new result shows up.'''
+
+	match = DETAIL_ID_RE.search(response_text)
+	return match.group(1) if match else None
+
+
+def iter_history_nodes(history_groups, stop_at=None):
+	'''Yields (group, node) for every result in query1 historyGroups, newest first, stopping before the `stop_at` ID.'''
+
+	for group in history_groups:
+		for node in group["historyDetails"]["nodes"]:
+			if node["id"] == stop_at:
+				return
+			yield group, node
+
+
+def merge_histories(runs, detail_key):
+	'''Lazily merges per-mode results (lists or ResultBuffers, each in the order it was fetched) into one stream, oldest first.'''
+
+	# every mode's history is already in time order (newest first, from splatnet), so a k-way merge is enough - only one
+	# result per mode is held at a time
+	played = lambda result: result["data"][detail_key]["playedTime"]
+	has_detail = lambda result: result["data"].get(detail_key) is not None # avoid {"vsHistoryDetail": None}
+
+	def oldest_first(run):
+		first, last = next(filter(has_detail, run), None), next(filter(has_detail, reversed(run)), None)
+		results = reversed(run) if first is not None and played(first) > played(last) else iter(run)
+		return filter(has_detail, results)
+
+	return heapq.merge(*[oldest_first(run) for run in runs], key=played)
+
+
+def id_epoch_time(b64_id):
+	'''Returns the epoch time embedded in a battle/job ID (<YYYYMMDD>T<HHMMSS>_<uuid>), or None if there isn't one.'''
+
+	match = re.search(r"(\d{8}T\d{6})_", base64.b64decode(b64_id).decode('utf-8'))
+	if match is None:
+		return None
+	utc_time = datetime.datetime.strptime(match.group(1), "%Y%m%dT%H%M%S")
+	return int((utc_time - datetime.datetime(1970, 1, 1)).total_seconds())
+
+
+def build_result_filters(config_data):
+	'''Returns predicates run on query1 history nodes, to drop excluded battles/jobs before fetching their details.'''
+
+	# each filter is called as f(node, group, is_job) and returns False to skip the result
+	# fields missing from a node never cause it to be skipped - post_result() still checks the full result
+	filters = []
+
+	if custom_key_exists("ignore_private", config_data):
+		filters.append(lambda node, group, is_job: is_job or (node.get("vsMode") or {}).get("mode") != "PRIVATE")
+	if custom_key_exists("ignore_private_jobs", config_data):
+		filters.append(lambda node, group, is_job: not is_job or group.get("mode") not in ("PRIVATE_CUSTOM", "PRIVATE_SCENARIO"))
+
+	modes = config_data.get("filter_modes") # e.g. ["BANKARA", "X_MATCH"] - battles only
+	if modes:
+		filters.append(lambda node, group, is_job: is_job or (node.get("vsMode") or {}).get("mode", modes[0]) in modes)
+
+	rules = config_data.get("filter_rules") # e.g. ["AREA", "CLAM"] for battles, ["BIG_RUN"] for jobs
+	if rules:
+		def rule_filter(node, group, is_job):
+			rule = group.get("rule") if is_job else (node.get("vsRule") or {}).get("rule")
+			return rule is None or rule in rules
+		filters.append(rule_filter)
+
+	for key in ("filter_since", "filter_until"): # YYYY-MM-DD, inclusive, in UTC
+		if config_data.get(key):
+			try:
+				day = datetime.datetime.strptime(config_data[key], "%Y-%m-%d")
+			except (TypeError, ValueError):
+				print(f"(!) Ignoring invalid {key} value in config.txt (expected YYYY-MM-DD)")
+				continue
+			bound = int((day - datetime.datetime(1970, 1, 1)).total_seconds())
+			if key == "filter_since":
+				filters.append(lambda node, group, is_job, bound=bound: (id_epoch_time(node["id"]) or bound) >= bound)
+			else:
+				bound += 86400 # through the end of that day
+				filters.append(lambda node, group, is_job, bound=bound: (id_epoch_time(node["id"]) or 0) < bound)
+
+	return filters
+
+
+def passes_filters(filters, node, group, is_job):
+	'''Returns True if a query1 history node passes every filter from build_result_filters().'''
+
+	return all(keep(node, group, is_job) for keep in filters)
+
+
+# keys pruned from the raw SplatNet JSON embedded in stat.ink uploads (splatnet_json), by payload profile
+PAYLOAD_PROFILES = {
+	"full":     frozenset(),
+	"standard": frozenset(["image", "image2d", "image2dThumbnail", "image3d", "image3dThumbnail",
+		"thumbnailImage", "originalImage", "maskingImage", "overlayImage", "backgroundImage"]), # image URLs
+	"minimal":  frozenset(["image", "image2d", "image2dThumbnail", "image3d", "image3dThumbnail",
+		"thumbnailImage", "originalImage", "maskingImage", "overlayImage", "backgroundImage",
+		"nameplate", "brand", "usualGearPower", "nextHistoryDetail", "previousHistoryDetail"]) # + duplicate nested objects
+}
+
+
+def slim_json(obj, profile):
+	'''Serializes a battle/job for splatnet_json, pruning the keys listed for the given payload profile.'''
+
+	drop_keys = PAYLOAD_PROFILES[profile]
+	if not drop_keys:
+		return json.dumps(obj)
+
+	def prune(thing):
+		if isinstance(thing, dict):
+			return {key: prune(value) for key, value in thing.items() if key not in drop_keys}
+		elif isinstance(thing, list):
+			return [prune(value) for value in thing]
+		return thing
+
+	return json.dumps(prune(obj), separators=(',', ':'), ensure_ascii=False)
+
+
 def gen_graphql_body(sha256hash, varname=None, varvalue=None):
 	'''Generates a JSON dictionary, specifying information to retrieve, to send with GraphQL requests.'''
 	great_passage = {
@@ -153,6 +538,28 @@ def gen_graphql_body(sha256hash, varname=None, varvalue=None):
 	return json.dumps(great_passage)
 
 
+def dump_json_list(items, fout):
+	'''Writes an iterable out as a JSON array one item at a time - the same output as json.dump(list(items), fout).'''
+
+	fout.write("[")
+	for i, item in enumerate(items):
+		if i:
+			fout.write(", ")
+		json.dump(item, fout)
+	fout.write("]")
+
+
+def write_json_atomic(path, obj):
+	'''Writes JSON to a temp file and renames it into place, so readers never see a half-written file.'''
+
+	tmp_path = f"{path}.tmp"
+	with open(tmp_path, "w") as fout:
+		json.dump(obj, fout)
+		fout.flush()
+		os.fsync(fout.fileno())
+	os.replace(tmp_path, path)
+
+
 def custom_key_exists(key, config_data, value=True):
 	'''Checks if a given config key exists in config.txt and is set to the specified value (true by default).'''
 
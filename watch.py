@@ -0,0 +1,151 @@
+# (ↄ) 2017-2024 eli fessler (frozenpandaman), clovervidia
+# https://github.com/frozenpandaman/s3s
+# License: GPLv3
+
+import ctypes, ctypes.util, json, os, select, struct, sys, time
+import archive, utils
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_NONBLOCK    = os.O_NONBLOCK
+IN_CLOEXEC     = 0o2000000
+INOTIFY_EVENT  = struct.Struct("iIII") # wd, mask, cookie, name length
+
+
+class FolderWatcher:
+	'''Reports files written into a folder - with inotify on Linux, otherwise by polling every `poll_secs`.'''
+
+	# only finished files count: inotify reports a file once it's closed or renamed into place, and polling waits for a
+	# file's size & mtime to hold still between two scans
+	def __init__(self, folder, poll_secs=5):
+		self.folder    = folder
+		self.poll_secs = poll_secs
+		self.fd        = None
+		self._seen     = self._scan()
+		self._changing = {}
+		try:
+			libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+			fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+			if fd < 0:
+				raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+			if libc.inotify_add_watch(fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+				os.close(fd)
+				raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+			self.fd = fd
+		except (OSError, AttributeError): # not linux, or out of watches - fall back to polling
+			self.fd = None
+
+	@property
+	def mode(self):
+		return "inotify" if self.fd is not None else "polling"
+
+	def _scan(self):
+		stamps = {}
+		with os.scandir(self.folder) as entries:
+			for entry in entries:
+				if entry.is_file():
+					stat = entry.stat()
+					stamps[entry.name] = (stat.st_size, stat.st_mtime_ns)
+		return stamps
+
+	def changes(self, timeout):
+		'''Waits up to `timeout` secs for files to be written, returning their names (an empty set if none were).'''
+		if self.fd is not None:
+			ready, _, _ = select.select([self.fd], [], [], max(0, timeout))
+			if not ready:
+				return set()
+			names = set()
+			try:
+				while True: # drain everything that's queued
+					buf = os.read(self.fd, 64 * 1024)
+					offset = 0
+					while offset < len(buf):
+						wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(buf, offset)
+						offset += INOTIFY_EVENT.size
+						names.add(os.fsdecode(buf[offset:offset+length].rstrip(b"\0")))
+						offset += length
+			except BlockingIOError:
+				pass
+			return names
+
+		time.sleep(min(max(0, timeout), self.poll_secs))
+		current = self._scan()
+		changed = set(name for name, stamp in current.items() if self._seen.get(name) != stamp)
+		settled = set(name for name in changed if self._changing.get(name) == current[name])
+		self._changing = {name: current[name] for name in changed - settled}
+		for name in settled:
+			self._seen[name] = current[name]
+		return settled
+
+	def close(self):
+		if self.fd is not None:
+			os.close(self.fd)
+			self.fd = None
+
+
+class Journal:
+	'''Which files in a watched folder have been processed, and how far into them (--watch flag).'''
+
+	# kept next to the folder (results.watch.json), like the export index
+	def __init__(self, folder):
+		self.path = f"{os.path.normpath(folder)}.watch.json"
+		try:
+			with open(self.path) as journal_file:
+				self.files = json.load(journal_file)
+		except (IOError, ValueError):
+			self.files = {}
+
+	def is_done(self, filename, stat):
+		'''Checks whether a file has been processed as it is now (same size & mtime).'''
+		entry = self.files.get(filename)
+		return entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns
+
+	def offset(self, filename):
+		'''Returns how many bytes of an appended-to (.ndjson) file have been processed already.'''
+		return self.files.get(filename, {}).get("offset") or 0
+
+	def lines(self, filename):
+		'''Returns how many lines of an .ndjson.gz file's last gzip member (starting at offset()) have been processed.'''
+		return self.files.get(filename, {}).get("lines") or 0
+
+	def mark(self, filename, stat, offset=None, lines=None):
+		self.files[filename] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "offset": offset, "lines": lines,
+			"at": int(time.time())}
+
+	def save(self):
+		utils.write_json_atomic(self.path, self.files)
+
+
+def read_new_results(folder, filename, journal):
+	'''Returns the results in a file that haven't been processed yet, noting it in the journal.'''
+
+	# the journal is only saved by the caller once the results are uploaded - until then, these marks are in memory only
+
+	path = os.path.join(folder, filename)
+	try:
+		stat = os.stat(path)
+	except OSError: # gone already
+		return []
+	if journal.is_done(filename, stat):
+		return []
+
+	try:
+		if filename.endswith(".ndjson"): # appended to by -o - pick up where we left off, complete lines only
+			results, offset = archive.read_ndjson_from(path, journal.offset(filename))
+			journal.mark(filename, stat, offset)
+			return results
+		if filename.endswith(".ndjson.gz"):
+			results, offset, lines = archive.read_ndjson_gz_from(path, journal.offset(filename), journal.lines(filename))
+			journal.mark(filename, stat, offset, lines)
+			return results
+		results = list(archive.read_results(path))
+	except (IOError, ValueError, EOFError):
+		print(f"(!) Could not read {filename} yet - will try again when it changes.")
+		return []
+	journal.mark(filename, stat)
+	return results
+
+
+if __name__ == "__main__":
+	print("This program cannot be run alone. See https://github.com/frozenpandaman/s3s")
+	sys.exit(0)